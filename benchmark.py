@@ -0,0 +1,289 @@
+import itertools as itr
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from graph_store import GraphStore
+from scooter_simulation import SimulateScooters
+from simulation_engine import SimulationEngine
+from truck_simulation import SimulateTrucks
+
+KINDS = ('grid', 'geometric')
+SCALES = {'small': 400, 'medium': 2500, 'large': 10000}  # approximate number of intersections
+STRATEGIES = ['aging', 'greedy', 'combined', 'brute', 'assignment']
+HUBS = (1, 3)  # transit hubs of the default scenarios
+SPACING = 100  # meters between neighbouring intersections
+METERS_PER_DEGREE = 111320
+# class constants set by a scenario, restored after every run
+CONSTANTS = {'SCOOTERS_TOTAL': SimulateScooters, 'NUMBER': SimulateTrucks}
+TOLERANCE = 0.2  # slow down or memory growth flagged as a regression
+
+
+def synthetic_city(kind, nodes, seed=0, center=SimulationEngine.CENTER):
+    """
+    Road network with the node and edge attributes osmnx produces (osmid, x,
+    y and length), built without any download. Every road is two way.
+
+    Args:
+        kind str: 'grid' for a jittered street grid or 'geometric' for intersections
+            placed at random and joined to the ones close by
+        nodes int: approximate number of intersections
+        seed int: seed of the layout
+        center (float, float): latitude and longitude the city is placed around
+
+    Returns:
+        <graph object>: largest connected part of the city
+    """
+    import networkx as nx
+
+    if kind not in KINDS:
+        raise ValueError("kind must be one of {}".format(", ".join(KINDS)))
+    rng = np.random.default_rng(seed)
+    side = int(math.ceil(math.sqrt(nodes)))
+    if kind == 'grid':
+        ij = np.array(list(itr.product(range(side), repeat=2)), dtype=np.float64)
+        points = (ij + rng.uniform(-0.2, 0.2, size=ij.shape)) * SPACING
+        edges = [(i * side + j, (i + di) * side + j + dj) for i, j in itr.product(range(side), repeat=2)
+                 for di, dj in ((0, 1), (1, 0)) if i + di < side and j + dj < side]
+    else:
+        points = rng.uniform(0, side * SPACING, size=(nodes, 2))
+        # radius giving about 6 neighbours per intersection, enough for nearly all of them to be
+        # connected, neighbours are found through cells of that size
+        radius = SPACING * math.sqrt(6 / math.pi)
+        cells = {}
+        for k, cell in enumerate(map(tuple, (points // radius).astype(np.int64))):
+            cells.setdefault(cell, []).append(k)
+        edges = []
+        for (cx, cy), members in cells.items():
+            near = [k for dx, dy in itr.product((-1, 0, 1), repeat=2) for k in cells.get((cx + dx, cy + dy), ())]
+            for u in members:
+                close = np.hypot(*(points[near] - points[u]).T) < radius
+                edges.extend((u, v) for v, c in zip(near, close) if c and u < v)
+
+    lat0, lon0 = center
+    lon = lon0 + points[:, 0] / (METERS_PER_DEGREE * math.cos(math.radians(lat0)))
+    lat = lat0 + points[:, 1] / METERS_PER_DEGREE
+    G = nx.MultiDiGraph()
+    G.add_nodes_from((k + 1, {'osmid': k + 1, 'x': float(lon[k]), 'y': float(lat[k])}) for k in range(len(points)))
+    for u, v in edges:
+        length = float(np.hypot(*(points[u] - points[v])))
+        G.add_edge(u + 1, v + 1, length=length, highway='residential')
+        G.add_edge(v + 1, u + 1, length=length, highway='residential')
+    largest = max(nx.weakly_connected_components(G), key=len)
+    return G.subgraph(largest).copy()
+
+
+class Scenario:
+
+    def __init__(self, kind='grid', scale='small', offices=10, scooters=200, trucks=8, turns=200, seed=0, hubs=1):
+        """
+        A synthetic city with its transit hubs, offices and fleet sizes.
+
+        Args:
+            kind str: 'grid' or 'geometric', see synthetic_city
+            scale str or int: key of SCALES or number of intersections
+            offices int: number of offices
+            scooters int: number of scooters
+            trucks int: number of trucks
+            turns int: turns to run per strategy
+        hubs List(int): numbers of transit hubs to run every city with
+            seed int: seed of layout, placement and simulation
+            hubs int: number of transit hubs, the metro included
+        """
+        self.kind = kind
+        self.scale = scale
+        self.nodes = SCALES.get(scale, scale)
+        self.offices = offices
+        self.scooters = scooters
+        self.trucks = trucks
+        self.turns = turns
+        self.seed = seed
+        self.hubs = hubs
+        self.store = None
+        self.metro_id = None
+        self.hub_ids = None
+        self.office_ids = None
+
+    @property
+    def name(self):
+        name = "{}-{}-o{}-s{}-t{}".format(self.kind, self.scale, self.offices, self.scooters, self.trucks)
+        # single hub names stay those of baselines saved before hubs were benchmarked
+        return name if self.hubs == 1 else "{}-h{}".format(name, self.hubs)
+
+    def build(self):
+        """
+        Generate the city, the metro is the intersection nearest its center,
+        offices and the other hubs are picked at random.
+
+        Returns:
+            float: seconds taken
+        """
+        start = time.perf_counter()
+        G = synthetic_city(self.kind, self.nodes, self.seed)
+        self.store = GraphStore.from_graph(G)
+        x, y = self.store.x, self.store.y
+        metro = int(np.argmin(np.hypot(x - x.mean(), y - y.mean())))
+        others = [i for i in range(len(self.store)) if i != metro]
+        rng = random.Random(self.seed)
+        picked = rng.sample(others, self.offices)
+        taken = set(picked)
+        hubs = [metro] + rng.sample([i for i in others if i not in taken], self.hubs - 1)
+        self.metro_id = int(self.store.node_ids[metro])
+        self.hub_ids = [int(self.store.node_ids[i]) for i in hubs]
+        self.office_ids = [int(self.store.node_ids[i]) for i in picked]
+        return time.perf_counter() - start
+
+    def engine(self, strategy):
+        for name, value in (('SCOOTERS_TOTAL', self.scooters), ('NUMBER', self.trucks)):
+            setattr(CONSTANTS[name], name, value)
+        hubs = self.hub_ids if self.hubs > 1 else self.metro_id
+        return SimulationEngine(self.store, hubs, self.office_ids, score_func=strategy, seed=self.seed)
+
+
+def run_benchmark(scenario, strategy, memory=True):
+    """
+    Time one strategy on a scenario. Turns are timed with a PhaseProfiler,
+    peak memory is measured with tracemalloc in a separate run so tracing
+    does not slow down the timed one.
+
+    Returns:
+        dict: result row, see save_baseline
+    """
+    defaults = {name: getattr(cls, name) for name, cls in CONSTANTS.items()}
+    try:
+        peak = None
+        if memory:
+            tracemalloc.start()
+            scenario.engine(strategy).run(scenario.turns)
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        start = time.perf_counter()
+        engine = scenario.engine(strategy)
+        setup = time.perf_counter() - start
+        profiler = engine.profile()
+        engine.run(scenario.turns)
+    finally:
+        for name, cls in CONSTANTS.items():
+            setattr(cls, name, defaults[name])
+    phases = {row['phase']: row for row in profiler.summary()}
+    seconds = phases['turn']['seconds']
+    plan = 'plan[{}]'.format(strategy)
+    return {
+        'name': "{}/{}".format(scenario.name, strategy),
+        'nodes': len(scenario.store),
+        'hubs': scenario.hubs,
+        'edges': scenario.store.edge_count(),
+        'turns': scenario.turns,
+        'setup_seconds': setup,
+        'turns_per_second': scenario.turns / seconds if seconds else float('inf'),
+        'scooters_ms': 1000 * phases['scooters']['seconds'] / scenario.turns,
+        'plan_ms': 1000 * phases[plan]['seconds'] / scenario.turns,
+        'trucks_ms': 1000 * phases['trucks']['seconds'] / scenario.turns,
+        'routing_ms': 1000 * phases['routing']['seconds'] / scenario.turns,
+        'peak_mb': peak,
+    }
+
+
+def run_suite(scenarios, strategies=STRATEGIES, memory=True, log=sys.stdout):
+    """
+    Returns:
+        List(dict): one row per scenario and strategy
+    """
+    results = []
+    for scenario in scenarios:
+        scenario.build()
+        for strategy in strategies:
+            row = run_benchmark(scenario, strategy, memory)
+            results.append(row)
+            if log:
+                print(format_row(row), file=log, flush=True)
+    return results
+
+
+def default_scenarios(scales=('small', 'medium'), turns=200, hubs=HUBS):
+    return [Scenario(kind, scale, turns=turns, hubs=count) for scale in scales for kind in KINDS for count in hubs]
+
+
+def format_row(row):
+    peak = "{:>8.1f}".format(row['peak_mb']) if row['peak_mb'] is not None else "{:>8}".format('-')
+    return "{:<44}{:>7}{:>5}{:>10.1f}{:>10.3f}{:>10.3f}{:>10.3f}{}".format(
+        row['name'], row['nodes'], row.get('hubs', 1), row['turns_per_second'], row['scooters_ms'], row['plan_ms'],
+        row['trucks_ms'], peak)
+
+
+def save_baseline(results, path):
+    """
+    Write results with the environment they were measured in, so later runs
+    can be compared against them.
+    """
+    meta = {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=1)
+
+
+def compare(baseline, results, tolerance=TOLERANCE):
+    """
+    Benchmarks that got slower or use more memory than the baseline by more
+    than the tolerance.
+
+    Args:
+        baseline str: baseline file written by save_baseline
+        results List(dict): current results
+        tolerance float: allowed relative change
+
+    Returns:
+        List(str): one line per regression
+    """
+    with open(baseline) as f:
+        before = {row['name']: row for row in json.load(f)['results']}
+    regressions = []
+    for row in results:
+        old = before.get(row['name'])
+        if old is None:
+            continue
+        if row['turns_per_second'] < old['turns_per_second'] * (1 - tolerance):
+            regressions.append("{}: {:.1f} turns/s, was {:.1f}".format(
+                row['name'], row['turns_per_second'], old['turns_per_second']))
+        if row['peak_mb'] and old['peak_mb'] and row['peak_mb'] > old['peak_mb'] * (1 + tolerance):
+            regressions.append("{}: peak {:.1f} MB, was {:.1f} MB".format(row['name'], row['peak_mb'],
+                                                                          old['peak_mb']))
+    return regressions
+
+
+def main(output, baseline=None, scales=('small', 'medium'), turns=200, hubs=HUBS):
+    """
+    Run the default suite, save it and compare it with a baseline.
+
+    Args:
+        output str: file to write results to
+        baseline str: baseline file to compare with, see compare
+        scales List(str): keys of SCALES to run
+        turns int: turns to run per strategy
+        hubs List(int): numbers of transit hubs to run every city with
+
+    Returns:
+        List(str): regressions found
+    """
+    print("{:<44}{:>7}{:>5}{:>10}{:>10}{:>10}{:>10}{:>8}".format('benchmark', 'nodes', 'hubs', 'turns/s',
+                                                                 'scoot ms', 'plan ms', 'truck ms', 'peak MB'))
+    suite = run_suite(default_scenarios(scales, turns, hubs))
+    save_baseline(suite, output)
+    found = compare(baseline, suite) if baseline else []
+    for line in found:
+        print("regression", line)
+    return found
+
+
+if __name__ == "__main__":
+    """
+    Pass the file to write results to, and optionally a baseline file to
+    compare them with. Exits with status 1 if there are regressions.
+    """
+    sys.exit(1 if main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None) else 0)
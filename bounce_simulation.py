@@ -1,43 +1,61 @@
 import matplotlib.pyplot as plt
 import numpy as np
-import osmnx as ox
 from matplotlib import animation
-from matplotlib.collections import LineCollection
 
-from scooter_simulation import SimulateScooters
-from truck_simulation import SimulateTrucks
+from density_layer import DensityLayer
+from metrics_recorder import MetricsRecorder
+from road_layer import RoadLayer
+from simulation_engine import SimulationEngine
 
 
 class BounceSimulation:
     FRAMES = 30
-
-    def __init__(self, score_func="aging"):
+    RENDER = ('points', 'density')
+
+    def __init__(self, score_func="aging", graph_file=None, frames=FRAMES, metrics_path=None, profile=False,
+                 render='points', engine=None):
+        """
+        Animates a SimulationEngine, drawing scooters and trucks after each turn
+
+        Args:
+            score_func str: name of a scoring registered in SimulateTrucks.SCORES or a planner, see SimulationEngine
+            graph_file str: local GraphML or OSM extract, default road network if None
+            frames int: number of turns to animate
+            metrics_path str: directory to stream metrics to, kept in memory if None
+            profile bool: time the phases of every turn, drawing included, in engine.profiler
+            render str: 'points' to draw every ridden scooter and a circle per office and hub,
+                'density' to draw scooters binned on a grid as one image, for large fleets
+            engine SimulationEngine: turn based engine to animate, e.g. built from a scenario file, score_func and
+                graph_file are ignored when given
+        """
+        if render not in BounceSimulation.RENDER:
+            raise ValueError("render must be one of {}".format(", ".join(BounceSimulation.RENDER)))
+        self.render = render
         self.node_values = []
         self.frame = 0
-        self.data = []
-        self.G = ox.graph_from_point((12.985660, 77.645015), distance=2000, network_type='drive')
-        metro = self.G.node.get(1563273556)
-        offices = [
-            self.G.node.get(6536735148),
-            self.G.node.get(6536735146),
-            self.G.node.get(1132680459),
-            self.G.node.get(1132675346),
-            self.G.node.get(1339408165),
-            self.G.node.get(1328155440),
-            self.G.node.get(1500759513),
-            self.G.node.get(1485686869),
-            self.G.node.get(3885545484),
-            self.G.node.get(1808901710),
-        ]
-        self.fixed_points = list(offices)
-        self.fixed_points.append(metro)
+        self.recorder = MetricsRecorder(metrics_path)
+        # road network is cached as arrays after the first download, or read from a local extract
+        if engine is None:
+            engine = SimulationEngine(SimulationEngine.load_store(graph_file), score_func=score_func)
+        if not engine.FLEET:
+            raise ValueError("{} does not keep scooter positions and cannot be rendered".format(type(engine).__name__))
+        self.store = engine.store
+        self.engine = engine
+        if profile:
+            self.engine.profile().instrument(self, 'draw_turn', 'draw')
+        self.engine.add_observer(self.recorder)
+        self.engine.add_observer(self.draw_turn)
+        self.scooters = self.engine.scooters
+        self.trucks = self.engine.trucks
         self.plot_trucks = None
         self.plot_scooters = None
+        self.turn_text = None
+        self.road_layer = RoadLayer(self.store, self.engine.office_ids, self.engine.hub_ids)
+        self.density_layer = DensityLayer(self.store, self.road_layer.extent()) if render == 'density' else None
 
-        # get north, south, east, west values either from bbox parameter or from the
-        # spatial extent of the edges' geometries
-        self.edges = ox.graph_to_gdfs(self.G, nodes=False, fill_edge_geometry=True)
-        west, south, east, north = self.edges.total_bounds
+        # get north, south, east, west values from the spatial extent of the edges' geometries,
+        # precomputed when the graph was stored
+        west, south, east, north = self.store.bounds
 
         # if caller did not pass in a fig_width, calculate it proportionately from
         # the fig_height and bounding box aspect ratio
@@ -45,47 +63,23 @@ class BounceSimulation:
         fig_height = 12  # in inches
         fig_width = fig_height / bbox_aspect_ratio
 
-        # create simulation object
-        self.scooters = SimulateScooters(self.G, offices, metro)
-        self.trucks = SimulateTrucks(self.G, offices, metro)
-        if score_func == "aging":
-            self.score_func = self.trucks.best_aging_score
-        elif score_func == "greedy":
-            self.score_func = self.trucks.best_greedy_score
-        else:
-            self.score_func = self.trucks.best_combined_score
-
         # create the figure and axis
         self.fig, self.ax = plt.subplots(figsize=(fig_width, fig_height), facecolor='w')
 
         # initialize animation function with setup plot, attach update plot function for each frame
-        self.ani = animation.FuncAnimation(self.fig, self.update_plot, frames=BounceSimulation.FRAMES,
-                                           init_func=self.setup_plot, blit=False)
+        self.ani = animation.FuncAnimation(self.fig, self.update_plot, frames=frames,
+                                           init_func=self.setup_plot, blit=True)
 
     def setup_plot(self):
-        # draw the edges as lines from node to node
-        lines = []
-        for u, v, data in self.G.edges(keys=False, data=True):
-            # if it doesn't have a geometry attribute, the edge is a straight
-            # line from node to node
-            x1 = self.G.nodes[u]['x']
-            y1 = self.G.nodes[u]['y']
-            x2 = self.G.nodes[v]['x']
-            y2 = self.G.nodes[v]['y']
-            line = [(x1, y1), (x2, y2)]
-            lines.append(line)
-
-        # add the lines to the axis as a linecollection
-        lc = LineCollection(lines, colors='#999999', linewidths=1, alpha=1, zorder=2)
-        self.ax.add_collection(lc)
-
-        # set the extent of the figure
-        west, south, east, north = self.edges.total_bounds
-        margin = 0.02
-        margin_ns = (north - south) * margin
-        margin_ew = (east - west) * margin
-        self.ax.set_ylim((south - margin_ns, north + margin_ns))
-        self.ax.set_xlim((west - margin_ew, east + margin_ew))
+        if self.plot_scooters is not None:
+            return self.plot_scooters, self.plot_trucks, self.turn_text
+
+        # if the graph is not projected, conform the aspect ratio to not stretch the plot
+        coslat = np.cos((self.store.y.min() + self.store.y.max()) / 2. / 180. * np.pi)
+        self.ax.set_aspect(1. / coslat)
+
+        # roads, offices and metro are drawn once into an image cached with the graph
+        self.road_layer.draw(self.ax)
 
         # configure axis appearance
         xaxis = self.ax.get_xaxis()
@@ -94,55 +88,56 @@ class BounceSimulation:
         xaxis.get_major_formatter().set_useOffset(False)
         yaxis.get_major_formatter().set_useOffset(False)
 
-        # set title
-        self.ax.set_title("Frame 0")
+        # turn counter inside the axis, so that blitting redraws it
+        self.turn_text = self.ax.text(0.02, 0.98, "Turn 0", transform=self.ax.transAxes, va='top', zorder=20)
 
-        # display fixed points
-        for point in self.fixed_points[:-1]:
-            self.ax.plot(point['x'], point['y'], 'o', color='blue')
-        red_fixed = self.fixed_points[-1]
-        self.ax.plot(red_fixed['x'], red_fixed['y'], 'o', color='red')
-
-        # setup scooter scatter artist
-        nodeXs, nodeYs = self.scooters.node_positions()
-        node_size = self.scooters.node_size()
-        nodeXs = np.array(nodeXs)
-        nodeYs = np.array(nodeYs)
-        self.plot_scooters = self.ax.scatter(nodeXs, nodeYs, s=node_size, c=node_size, alpha=0.6, edgecolor=None,
-                                             zorder=10,
-                                             cmap='gnuplot')
+        # setup scooter scatter artist, or a single image of scooters per cell
+        if self.density_layer is not None:
+            self.plot_scooters = self.density_layer.draw(self.ax)
+            self.density_layer.update(self.density_layer.histogram(*self.scooters.node_counts()))
+        else:
+            nodeXs, nodeYs = self.scooters.node_positions()
+            node_size = self.scooters.node_size()
+            self.plot_scooters = self.ax.scatter(nodeXs, nodeYs, s=node_size, c=node_size, alpha=0.6, edgecolor=None,
+                                                 zorder=10,
+                                                 cmap='gnuplot')
 
         # setup truck scatter artist
         truckx, trucky = self.trucks.get_pos()
-        truckx, trucky = np.array(truckx), np.array(trucky)
         truck_size = self.trucks.get_size()
         self.plot_trucks = self.ax.scatter(truckx, trucky, s=truck_size, c=truck_size, alpha=0.6, edgecolor=None,
                                            zorder=15, cmap='plasma')
-
-        # if the graph is not projected, conform the aspect ratio to not stretch the plot
-        coslat = np.cos((min(nodeYs) + max(nodeYs)) / 2. / 180. * np.pi)
-        self.ax.set_aspect(1. / coslat)
         self.fig.canvas.draw()
+        return self.plot_scooters, self.plot_trucks, self.turn_text
 
     def update_plot(self, i):
-        self.ax.set_title("Turn {}".format(i))
-
-        # modify scooter scatter plot artist
-        self.data.append(self.scooters.turn(i))
-        node_size = np.array(self.scooters.node_size())
-        x, y = self.scooters.node_positions()
-        node_pos = np.c_[x, y]
-        self.plot_scooters.set_sizes(node_size)  # changes size of points
-        self.plot_scooters.set_array(node_size)  # changes color of points
-        self.plot_scooters.set_offsets(node_pos)  # changes position of points
+        self.engine.step()
+        return self.plot_scooters, self.plot_trucks, self.turn_text
+
+    def draw_turn(self, engine, metrics):
+        """
+        Observer for the simulation engine, updates the scooter and truck
+        artists for the finished turn.
+
+        Args:
+            engine SimulationEngine: simulation that finished a turn
+            metrics TurnMetrics: metrics logged for the turn
+        """
+        self.turn_text.set_text("Turn {}".format(metrics.turn))
+
+        if self.density_layer is not None:
+            # bin every scooter, parked or ridden, cost of drawing depends on the grid only
+            self.density_layer.update(self.density_layer.histogram(*self.scooters.node_counts()))
+        else:
+            # modify scooter scatter plot artist
+            node_size = np.array(self.scooters.node_size())
+            x, y = self.scooters.node_positions()
+            node_pos = np.c_[x, y]
+            self.plot_scooters.set_sizes(node_size)  # changes size of points
+            self.plot_scooters.set_array(node_size)  # changes color of points
+            self.plot_scooters.set_offsets(node_pos)  # changes position of points
 
         # modify truck scatter plot artist
-        self.trucks.calculate_path(self.scooters.scooters_office, self.score_func)
-        metro, office, metric = self.trucks.update_truck_pos(self.scooters.scooters_metro,
-                                                             self.scooters.scooters_office)
-        self.data.append(metric)
-        self.scooters.scooters_metro = metro
-        self.scooters.scooters_office = office
         truckx, trucky = self.trucks.get_pos()
         truck_pos = np.c_[truckx, trucky]
         truck_size = np.array(self.trucks.get_size())
@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class DemandProfile:
+    TURNS_PER_DAY = 1440  # one turn per minute
+    # customers per turn relative to the mean rate, one value per hour of the day
+    MORNING_PEAK = [0.1, 0.05, 0.05, 0.05, 0.1, 0.3, 0.8, 2.5, 4.5, 3.5, 1.5, 1.0,
+                    1.0, 1.0, 0.8, 0.8, 0.8, 0.9, 1.0, 0.8, 0.5, 0.3, 0.2, 0.1]
+
+    def __init__(self, rate, curve=None, turns_per_day=TURNS_PER_DAY, poisson=False, office_weights=None,
+                 hub_weights=None):
+        """
+        Customers exiting the metro each turn, or each transit hub when there
+        are several, and the office each of them rides to.
+
+        Args:
+            rate float: mean customers per turn
+            curve List(float): rate multipliers spread evenly over a day and interpolated
+                between, e.g. MORNING_PEAK, constant rate if None
+            turns_per_day int: length of the day the curve spans
+            poisson bool: draw arrivals from a Poisson distribution around the rate,
+                otherwise the rate is rounded to a fixed number of customers
+            office_weights List(float): relative popularity of each office, uniform if None
+            hub_weights List(float): share of customers exiting each hub, uniform if None
+        """
+        self.rate = rate
+        self.curve = None if curve is None else np.asarray(curve, dtype=np.float64)
+        self.turns_per_day = turns_per_day
+        self.poisson = poisson
+        self.office_prob = None if office_weights is None else self.normalize(office_weights, 'office')
+        self.hub_prob = None if hub_weights is None else self.normalize(hub_weights, 'hub')
+
+    @staticmethod
+    def normalize(weights, kind):
+        weights = np.asarray(weights, dtype=np.float64)
+        if (weights < 0).any() or not weights.sum():
+            raise ValueError("{} weights must be non negative and not all zero".format(kind))
+        return weights / weights.sum()
+
+    def rate_at(self, turn):
+        """
+        Mean customers per turn at the given turn, turn may also be an array.
+        """
+        if self.curve is None:
+            return np.full(np.shape(turn), float(self.rate)) if np.ndim(turn) else float(self.rate)
+        # position in the day in units of curve points, wrapping around midnight
+        points = len(self.curve)
+        position = np.mod(turn, self.turns_per_day) * points / self.turns_per_day
+        wrapped = np.append(self.curve, self.curve[0])
+        return self.rate * np.interp(position, np.arange(points + 1), wrapped)
+
+    def arrivals(self, turn, rng):
+        """
+        Returns:
+            int: customers exiting the metro in the turn
+        """
+        rate = self.rate_at(turn)
+        if self.poisson:
+            return int(rng.poisson(rate))
+        return int(round(rate))
+
+    def next_busy(self, turn, end):
+        """
+        First turn from the given one, before end, in which customers can arrive.
+
+        Returns:
+            int: turn, or end if there is none
+        """
+        if turn >= end:
+            return end
+        busy = np.flatnonzero(self.rate_at(np.arange(turn, end)) > (0 if self.poisson else 0.5))
+        return turn + int(busy[0]) if len(busy) else end
+
+    def destinations(self, customers, offices, rng):
+        """
+        Office of every customer.
+
+        Args:
+            customers int: number of customers
+            offices int: number of offices
+            rng <numpy Generator>: source of random draws
+
+        Returns:
+            array(int): office id for each customer
+        """
+        if self.office_prob is None:
+            return rng.integers(0, offices, size=customers)
+        if len(self.office_prob) != offices:
+            raise ValueError("expected {} office weights, got {}".format(offices, len(self.office_prob)))
+        return rng.choice(offices, size=customers, p=self.office_prob)
+
+    def origins(self, customers, hubs, rng):
+        """
+        Split the customers of a turn between hubs.
+
+        Args:
+            customers int: number of customers
+            hubs int: number of hubs
+            rng <numpy Generator>: source of random draws
+
+        Returns:
+            array(int): customers exiting each hub
+        """
+        if self.hub_prob is None:
+            return rng.multinomial(customers, np.full(hubs, 1 / hubs))
+        if len(self.hub_prob) != hubs:
+            raise ValueError("expected {} hub weights, got {}".format(hubs, len(self.hub_prob)))
+        return rng.multinomial(customers, self.hub_prob)
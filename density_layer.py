@@ -0,0 +1,74 @@
+import numpy as np
+
+
+class DensityLayer:
+    BINS = 200  # cells along the longer side of the map
+    CMAP = 'gnuplot'
+    ALPHA = 0.8
+
+    def __init__(self, store, extent, bins=BINS):
+        """
+        Vehicles binned onto a grid over the map and drawn as one image, for
+        fleets too large to draw a point per vehicle. Vehicles stand on graph
+        nodes, so the cell of every node is computed once and a frame is a
+        single bincount, while drawing only depends on the size of the grid.
+
+        Args:
+            store GraphStore: road network arrays
+            extent (float, float, float, float): west, east, south and north limits of the map
+            bins int: cells along the longer side of the map, cells are about square on screen
+        """
+        west, east, south, north = extent
+        # longitude degrees are shorter than latitude degrees away from the equator
+        width = (east - west) * np.cos((south + north) / 2. / 180. * np.pi)
+        height = north - south
+        cols = bins if width >= height else max(1, int(round(bins * width / height)))
+        rows = bins if height >= width else max(1, int(round(bins * height / width)))
+        self.shape = (rows, cols)
+        self.extent = extent
+        col = np.clip(((store.x - west) / (east - west) * cols).astype(np.int64), 0, cols - 1)
+        row = np.clip(((store.y - south) / (north - south) * rows).astype(np.int64), 0, rows - 1)
+        self.cell = row * cols + col  # grid cell of every node
+        self.colors = None  # RGBA of 256 levels, low to high
+        self.image = None
+
+    def histogram(self, nodes, weights=None):
+        """
+        Args:
+            nodes array(int): node position of every vehicle
+            weights array(float): weight of every vehicle, one each if None
+
+        Returns:
+            array(float): rows x cols vehicles per cell, south row first
+        """
+        counts = np.bincount(self.cell[nodes], weights=weights, minlength=self.shape[0] * self.shape[1])
+        return counts.reshape(self.shape)
+
+    def draw(self, ax, zorder=10):
+        """
+        Add the empty image to the axis, cells without vehicles are transparent.
+
+        Returns:
+            <image artist>: the image updated by update
+        """
+        from matplotlib.cm import ScalarMappable
+        from matplotlib.colors import Normalize
+
+        # colors are looked up in a table, so matplotlib only resamples the image when drawing
+        self.colors = ScalarMappable(Normalize(0, 1), DensityLayer.CMAP).to_rgba(
+            np.linspace(0, 1, 256), alpha=DensityLayer.ALPHA, bytes=True)
+        self.image = ax.imshow(np.zeros(self.shape + (4,), dtype=np.uint8), extent=self.extent, origin='lower',
+                               aspect=ax.get_aspect(), interpolation='nearest', zorder=zorder)
+        return self.image
+
+    def update(self, counts):
+        """
+        Show new counts, the color scale is logarithmic up to the fullest cell.
+
+        Args:
+            counts array(float): grid as returned by histogram
+        """
+        scale = np.log1p(max(counts.max(), 1))
+        rgba = self.colors[(np.log1p(counts) * (255 / scale)).astype(np.uint8)]
+        rgba[counts < 1, 3] = 0
+        self.image.set_data(rgba)
@@ -0,0 +1,307 @@
+import heapq
+import itertools as itr
+
+import numpy as np
+
+from profiler import PhaseProfiler
+from scooter_simulation import SimulateScooters
+from simulation_engine import SimulationEngine, TurnMetrics
+from truck_simulation import SimulateTrucks
+
+
+class EventSimulation(SimulationEngine):
+    # event phases within a turn, in the order the turn based loop applies them
+    REPLENISH = 0  # scooters parked at an office return to metro
+    RIDE_ARRIVAL = 1  # ridden scooters reach an office
+    WAKE = 2  # customers are waiting and scooters became available
+    TRUCK_ARRIVAL = 3  # truck reaches the office or metro it was sent to
+    PROFILED = [(None, 'step', PhaseProfiler.TURN), (None, 'quiet_step', PhaseProfiler.TURN),
+                (None, 'replenish', 'replenish'), (None, 'customers', 'customers'), (None, 'plan_paths', 'plan'),
+                (None, 'start_trips', 'trips'), (None, 'truck_arrival', 'trucks'), (None, 'notify', 'observers')]
+    FLEET = False  # only counts per office and hub are kept, positions of single scooters are not
+
+    def __init__(self, store, metro=None, offices=None, score_func="aging", seed=None, routing='hops', demand=None):
+        """
+        Event driven version of SimulationEngine. Instead of moving every
+        scooter and truck one step per turn, the turn at which a ride or a truck
+        trip ends is known when it starts and is pushed on a priority queue, and
+        customers are kept as one count per arrival turn. A turn only does work
+        for the events due in it, turns without any are skipped over while still
+        logging the same TurnMetrics as the turn based engine.
+
+        Only a single transit hub, the metro, is supported. Scooters are
+        only counted, so the engine cannot be drawn by BounceSimulation or
+        RenderPipeline.
+
+        Args:
+            see SimulationEngine
+        """
+        super().__init__(store, metro, offices, score_func, seed, routing, demand)
+        if len(self.hub_ids) > 1:
+            raise ValueError("the event driven engine supports a single hub")
+        self.events = []  # heap of (turn, phase, sequence, payload)
+        self.sequence = itr.count()
+        self.cohorts = self.scooters.que  # waiting customers, shared with the scooters
+        self.riding = 0  # scooters currently ridden
+        self.last_visit = np.full(len(self.offices), -1, dtype=np.int64)  # last turn a truck visited each office
+        self.epoch = np.zeros(len(self.offices), dtype=np.int64)  # replenish events of older epochs are stale
+        self.trips = {}  # truck id -> (departure turn, arrival turn, steps)
+        self.settled_dist = 0  # distance of finished truck trips
+        self.departures = 0  # sum of departure turns of trucks on a trip
+        self.rng = self.scooters.rng
+
+    def get_state(self):
+        """
+        State of the turn based engine plus pending events, trips and
+        counters. Events are stored as (turn, phase, sequence, payload),
+        with payload -1, -1 for wake ups, trips as (truck, departure,
+        arrival, steps).
+        """
+        state = super().get_state()
+        events = [(turn, phase, sequence) + ((-1, -1) if payload is None else payload)
+                  for turn, phase, sequence, payload in self.events]
+        trips = [(truck_id,) + trip for truck_id, trip in self.trips.items()]
+        state['events'] = {
+            'events': np.array(events, dtype=np.int64).reshape(-1, 5),
+            'trips': np.array(trips, dtype=np.int64).reshape(-1, 4),
+            'riding': int(self.riding),
+            'last_visit': self.last_visit,
+            'epoch': self.epoch,
+            'settled_dist': int(self.settled_dist),
+            'departures': int(self.departures),
+        }
+        return state
+
+    def set_state(self, state, restore_random=True):
+        super().set_state(state, restore_random)
+        events = state['events']
+        self.events = [(turn, phase, sequence, None if phase == EventSimulation.WAKE else (a, b))
+                       for turn, phase, sequence, a, b in events['events'].tolist()]
+        heapq.heapify(self.events)
+        # only the order of sequence numbers matters, new events come after pending ones
+        self.sequence = itr.count(max((event[2] for event in self.events), default=-1) + 1)
+        self.trips = {truck_id: (depart, arrive, length) for truck_id, depart, arrive, length in
+                      events['trips'].tolist()}
+        self.riding = events['riding']
+        self.last_visit = events['last_visit']
+        self.epoch = events['epoch']
+        self.settled_dist = events['settled_dist']
+        self.departures = events['departures']
+        self.cohorts = self.scooters.que
+        self.rng = self.scooters.rng
+
+    def schedule(self, turn, phase, payload):
+        heapq.heappush(self.events, (turn, phase, next(self.sequence), payload))
+
+    def pop_events(self, turn, phase):
+        while self.events and self.events[0][0] == turn and self.events[0][1] == phase:
+            yield heapq.heappop(self.events)[3]
+
+    def truck_dist(self, turn):
+        """
+        Steps taken by all trucks up to and including the given turn.
+        """
+        return self.settled_dist + len(self.trips) * (turn + 1) - self.departures
+
+    def needs_plan(self):
+        """
+        Planning can only change something if an idle truck is full, or could
+        pick up scooters.
+        """
+        idle = [i for i in range(SimulateTrucks.NUMBER) if i not in self.trips]
+        if not idle:
+            return False
+        if any(self.trucks.truck_cap[i] == SimulateTrucks.CAPACITY for i in idle):
+            return True
+        return bool(np.any(np.asarray(self.scooters.scooters_office) > 0))
+
+    def is_active(self, turn):
+        """
+        True if something other than counters accumulating happens in the turn.
+        """
+        if self.scooters.demand.next_busy(turn, turn + 1) == turn or (self.events and self.events[0][0] <= turn):
+            return True
+        if self.cohorts and (self.cohorts[0][0] == turn or self.scooters.scooters_metro):
+            return True
+        return self.needs_plan()
+
+    def next_active(self, turn, end):
+        """
+        First turn from the given one that is active, or end.
+        """
+        if self.is_active(turn):
+            return turn
+        candidates = [self.scooters.demand.next_busy(turn, end)]
+        if self.events:
+            candidates.append(self.events[0][0])
+        if self.cohorts:
+            candidates.append(self.cohorts[0][0])
+        return max(turn, min(candidates))
+
+    def replenish(self, turn, office_id):
+        """
+        Each parked scooter returns to metro with probability REPLENISH every
+        turn, so the first turn in which any of the n scooters at an office
+        returns is geometric with probability 1 - (1 - REPLENISH)^n. One such
+        event is pending per office, it is drawn again whenever the number of
+        scooters there changes, which is exact since the time to return does not
+        depend on how long a scooter has been waiting.
+        """
+        self.epoch[office_id] += 1
+        scooters = int(self.scooters.scooters_office[office_id])
+        if not SimulateScooters.REPLENISH or scooters <= 0:
+            return
+        any_back = -np.expm1(scooters * np.log1p(-SimulateScooters.REPLENISH))
+        when = turn + int(self.rng.geometric(any_back))
+        self.schedule(when, EventSimulation.REPLENISH, (office_id, int(self.epoch[office_id])))
+
+    def returning(self, scooters):
+        """
+        Number of scooters out of the given ones that return in a turn, given
+        that at least one does: the first one to return is drawn from the
+        geometric distribution cut at scooters, those after it return
+        independently.
+        """
+        p = SimulateScooters.REPLENISH
+        any_back = -np.expm1(scooters * np.log1p(-p))
+        first = int(np.ceil(np.log1p(-self.rng.random() * any_back) / np.log1p(-p)))
+        first = min(max(first, 1), scooters)
+        return 1 + int(self.rng.binomial(scooters - first, p))
+
+    def customers(self, turn):
+        """
+        Drop customers whose waiting time ran out, serve the rest in arrival order
+        and send their scooters on rides.
+        """
+        scooters = self.scooters
+        served = scooters.serve(turn)
+        if served:
+            self.riding += served
+            offices = np.bincount(scooters.demand.destinations(served, len(scooters.office_idx), self.rng),
+                                  minlength=len(scooters.office_idx))
+            for office_id in np.flatnonzero(offices).tolist():
+                ride = max(1, int(scooters.path_len[office_id]) - 1)
+                self.schedule(turn + ride, EventSimulation.RIDE_ARRIVAL, (office_id, int(offices[office_id])))
+        scooters.arrive(turn)
+
+    def start_trips(self, turn):
+        """
+        Schedule the arrival of trucks that were given a path while planning.
+        Like update_truck_pos, a truck stops at the first office or metro on its path.
+        """
+        trucks = self.trucks
+        for truck_id, steps in enumerate(trucks.next_steps):
+            if trucks.is_idle(truck_id) or truck_id in self.trips:
+                continue
+            stops = np.flatnonzero((steps == trucks.metro) | (trucks.office_at[steps] >= 0))
+            k = int(stops[0]) if len(stops) else len(steps) - 1
+            self.trips[truck_id] = (turn, turn + k, k + 1)
+            self.departures += turn
+            self.schedule(turn + k, EventSimulation.TRUCK_ARRIVAL, (truck_id, int(steps[k])))
+
+    def truck_arrival(self, turn, truck_id, step):
+        trucks = self.trucks
+        depart, _, length = self.trips.pop(truck_id)
+        self.departures -= depart
+        self.settled_dist += length
+        trucks.truck_pos[truck_id] = step
+        trucks.next_steps[truck_id] = None
+        if step == trucks.metro:
+            # delivered scooters to metro, waiting customers can take them next turn
+            self.scooters.scooters_metro += trucks.truck_cap[truck_id]
+            trucks.truck_cap[truck_id] = 0
+            if self.cohorts:
+                self.schedule(turn + 1, EventSimulation.WAKE, None)
+        else:
+            office_id = trucks.office_at[step]
+            office_scooters = self.scooters.scooters_office
+            take = min(SimulateTrucks.CAPACITY - trucks.truck_cap[truck_id], office_scooters[office_id])
+            office_scooters[office_id] -= take
+            trucks.truck_cap[truck_id] += take
+            trucks.scooters_picked += take
+            self.last_visit[office_id] = turn
+            if take:
+                self.replenish(turn, office_id)
+
+    def step(self):
+        """
+        Process all events of the current turn
+
+        Returns:
+            TurnMetrics: metrics logged for the turn
+        """
+        turn = self.turn
+        scooters = self.scooters
+        for office_id, epoch in self.pop_events(turn, EventSimulation.REPLENISH):
+            if epoch != self.epoch[office_id]:
+                continue
+            count = self.returning(int(scooters.scooters_office[office_id]))
+            scooters.scooters_office[office_id] -= count
+            scooters.scooters_metro += count
+            self.replenish(turn, office_id)
+        for office_id, count in self.pop_events(turn, EventSimulation.RIDE_ARRIVAL):
+            scooters.scooters_office[office_id] += count
+            self.riding -= count
+            self.replenish(turn, office_id)
+        for _ in self.pop_events(turn, EventSimulation.WAKE):
+            pass
+        self.customers(turn)
+        scooters.under_utilization += SimulateScooters.SCOOTERS_TOTAL - self.riding
+
+        if self.needs_plan():
+            self.trucks.turns_without_visit = (turn - self.last_visit).tolist()
+            self.plan_paths(scooters.scooters_office)
+            self.start_trips(turn)
+        # trucks reaching the same office in a turn load in truck order
+        for truck_id, step in sorted(self.pop_events(turn, EventSimulation.TRUCK_ARRIVAL), key=lambda e: e[0]):
+            self.truck_arrival(turn, truck_id, step)
+        return self.finish_turn()
+
+    def quiet_step(self):
+        """
+        A turn without events, only counters accumulate.
+        """
+        self.scooters.under_utilization += SimulateScooters.SCOOTERS_TOTAL - self.riding
+        return self.finish_turn()
+
+    def finish_turn(self):
+        turn = self.turn
+        scooters = self.scooters
+        self.trucks.dist_travelled = self.truck_dist(turn)
+        avg_waiting_time = scooters.total_waiting_time / scooters.customers_served if scooters.customers_served else 0
+        under_utilization = scooters.under_utilization / (SimulateScooters.SCOOTERS_TOTAL * turn) if turn else 0
+        truck_utilization = (self.trucks.scooters_picked / (SimulateTrucks.NUMBER * self.trucks.dist_travelled)
+                             if self.trucks.dist_travelled else 0)
+        metrics = TurnMetrics(turn, avg_waiting_time, scooters.customers_dropped, under_utilization,
+                              truck_utilization)
+        self.turn += 1
+        if self.observers:
+            self.sync_positions()
+            self.notify(metrics)
+        return metrics
+
+    def sync_positions(self):
+        """
+        Move trucks on a trip to where the turn based engine would have them,
+        only needed when something looks at positions between events.
+        """
+        for truck_id, (depart, _, _) in self.trips.items():
+            self.trucks.truck_pos[truck_id] = self.trucks.next_steps[truck_id][self.turn - 1 - depart]
+
+    def run(self, n_turns):
+        """
+        Args:
+            n_turns int: number of turns to simulate
+
+        Returns:
+            List(TurnMetrics): metrics for each turn
+        """
+        end = self.turn + n_turns
+        metrics = []
+        while self.turn < end:
+            active = self.next_active(self.turn, end)
+            while self.turn < active:
+                metrics.append(self.quiet_step())
+            if self.turn < end:
+                metrics.append(self.step())
+        return metrics
@@ -0,0 +1,138 @@
+import io
+import os
+
+from matplotlib import animation
+
+
+class PillowChunkWriter:
+
+    def __init__(self, fps):
+        """
+        Writes GIF files with Pillow. Frames are kept as palette images until
+        finish is called, so memory is bounded by the number of frames per file.
+        """
+        self.fps = fps
+        self.fig = None
+        self.outfile = None
+        self.dpi = None
+        self.frames = []
+
+    def setup(self, fig, outfile, dpi):
+        self.fig = fig
+        self.outfile = outfile
+        self.dpi = dpi
+        self.frames = []
+
+    def grab_frame(self):
+        from PIL import Image
+        buf = io.BytesIO()
+        self.fig.savefig(buf, format='rgba', dpi=self.dpi)
+        # Agg truncates fractional pixels of the figure size
+        width, height = (self.fig.get_size_inches() * self.dpi).astype(int)
+        image = Image.frombuffer('RGBA', (width, height), buf.getbuffer(), 'raw', 'RGBA', 0, 1)
+        self.frames.append(image.convert('RGB').convert('P', palette=Image.ADAPTIVE))
+
+    def finish(self):
+        if self.frames:
+            self.frames[0].save(self.outfile, save_all=True, append_images=self.frames[1:],
+                                duration=int(1000 / self.fps), loop=0)
+        self.frames = []
+
+
+class StreamingExporter:
+    WRITERS = ('ffmpeg', 'pillow')
+    PILLOW_CHUNK = 150  # frames per GIF file when writing with Pillow
+
+    def __init__(self, fig, path, fps=10, dpi=100, chunk_frames=None, writer='ffmpeg'):
+        """
+        Writes frames of a figure to disk as they are drawn instead of keeping
+        the whole animation in memory. With ffmpeg frames are piped straight to
+        the encoder. Pillow needs all frames of a GIF at once, so its output is
+        always split into files of at most PILLOW_CHUNK frames.
+
+        Args:
+            fig <matplotlib figure>: figure to capture
+            path str: output file, chunks are numbered path_000.ext, path_001.ext, ...
+            fps int: frames per second of the output
+            dpi int: resolution of captured frames
+            chunk_frames int: frames per output file, one file if None
+            writer str: 'ffmpeg' or 'pillow'
+        """
+        if writer not in StreamingExporter.WRITERS:
+            raise ValueError("writer must be one of {}".format(", ".join(StreamingExporter.WRITERS)))
+        if writer == 'pillow' and not chunk_frames:
+            chunk_frames = StreamingExporter.PILLOW_CHUNK
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.fig = fig
+        self.path = path
+        self.fps = fps
+        self.dpi = dpi
+        self.chunk_frames = chunk_frames
+        self.writer_name = writer
+        self.writer = None
+        self.frames = 0
+        self.files = []
+
+    def chunk_path(self, chunk):
+        if not self.chunk_frames:
+            return self.path
+        root, ext = os.path.splitext(self.path)
+        return "{}_{:03d}{}".format(root, chunk, ext)
+
+    def new_writer(self):
+        if self.writer_name == 'ffmpeg':
+            return animation.FFMpegWriter(fps=self.fps)
+        return PillowChunkWriter(self.fps)
+
+    def grab(self):
+        """
+        Capture the current state of the figure.
+        """
+        if self.writer is None:
+            outfile = self.chunk_path(len(self.files))
+            self.writer = self.new_writer()
+            self.writer.setup(self.fig, outfile, self.dpi)
+            self.files.append(outfile)
+        self.writer.grab_frame()
+        self.frames += 1
+        if self.chunk_frames and self.frames % self.chunk_frames == 0:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            writer, self.writer = self.writer, None
+            writer.finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def export_animation(fig, update, turns, path, init=None, every=1, **kwargs):
+    """
+    Run update for every turn and stream every k-th frame to disk.
+
+    Args:
+        fig <matplotlib figure>: figure updated by update
+        update: callable taking the turn number, e.g. BounceSimulation.update_plot
+        turns int: number of turns to run
+        path str: output file
+        init: callable drawing the initial state, e.g. BounceSimulation.setup_plot
+        every int: capture one frame every this many turns
+        kwargs: passed to StreamingExporter
+
+    Returns:
+        List(str): files written
+    """
+    if init is not None:
+        init()
+    with StreamingExporter(fig, path, **kwargs) as exporter:
+        for turn in range(turns):
+            update(turn)
+            if turn % every == 0:
+                exporter.grab()
+    return exporter.files
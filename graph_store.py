@@ -0,0 +1,290 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class GraphStore:
+    CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'graph_cache')
+    ARRAYS = ('node_ids', 'x', 'y', 'indptr', 'indices', 'lengths')
+    OPTIONAL = ('speeds',)  # arrays missing from stores cached by older versions
+    META = 'meta.json'
+    DEFAULT_SPEED = 30  # km/h for roads without maxspeed or a known highway type
+    HIGHWAY_SPEEDS = {'motorway': 80, 'trunk': 60, 'primary': 50, 'secondary': 40, 'tertiary': 35,
+                      'residential': 25, 'living_street': 10, 'service': 15, 'unclassified': 25}  # km/h
+    MPH = 1.609344
+
+    def __init__(self, node_ids, x, y, indptr, indices, lengths, bounds, path=None, speeds=None):
+        """
+        Road network held as flat arrays. Adjacency is stored in CSR form,
+        the neighbours of node i are indices[indptr[i]:indptr[i + 1]] with edge
+        lengths in the same positions of lengths.
+
+        Args:
+            node_ids array(int): osm id of each node
+            x array(float): x coordinate (longitude) of each node
+            y array(float): y coordinate (latitude) of each node
+            indptr array(int): offsets into indices for each node
+            indices array(int): position of the edge target node
+            lengths array(float): length of each edge in meters
+            bounds (float, float, float, float): west, south, east, north extent
+            path str: directory the store was saved to or loaded from
+            speeds array(float): speed on each edge in km/h, DEFAULT_SPEED everywhere if None
+        """
+        self.node_ids = node_ids
+        self.x = x
+        self.y = y
+        self.indptr = indptr
+        self.indices = indices
+        self.lengths = lengths
+        if speeds is None:
+            speeds = np.full(len(indices), GraphStore.DEFAULT_SPEED, dtype=np.float64)
+        self.speeds = speeds
+        self.bounds = tuple(bounds)
+        self.path = path
+        self.node_index = {osmid: i for i, osmid in enumerate(node_ids.tolist())}
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @staticmethod
+    def cache_key(*parts):
+        return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+    @classmethod
+    def from_point(cls, center, distance, network_type='drive', cache_dir=None):
+        """
+        Load the road network around a point from the cache, downloading and
+        caching it with osmnx on the first call.
+
+        Args:
+            center (float, float): latitude and longitude of the center point
+            distance int: distance in meters from center to keep
+            network_type str: osmnx network type
+            cache_dir str: directory holding cached graphs
+
+        Returns:
+            GraphStore
+        """
+        key = cls.cache_key('point', round(center[0], 6), round(center[1], 6), distance, network_type)
+        path = os.path.join(cache_dir or cls.CACHE_DIR, key)
+        if os.path.exists(os.path.join(path, cls.META)):
+            return cls.load(path)
+
+        import osmnx as ox
+        G = ox.graph_from_point(center, distance=distance, network_type=network_type)
+        store = cls.from_graph(G)
+        store.save(path)
+        return store
+
+    @classmethod
+    def from_file(cls, filename, network_type='drive', cache_dir=None):
+        """
+        Load the road network from a local GraphML or OSM XML extract, caching
+        the converted arrays keyed by the file path and modification time.
+
+        Args:
+            filename str: path to a .graphml or .osm file
+            network_type str: osmnx network type, used for OSM XML extracts
+            cache_dir str: directory holding cached graphs
+
+        Returns:
+            GraphStore
+        """
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        key = cls.cache_key('file', filename, stat.st_size, int(stat.st_mtime), network_type)
+        path = os.path.join(cache_dir or cls.CACHE_DIR, key)
+        if os.path.exists(os.path.join(path, cls.META)):
+            return cls.load(path)
+
+        import osmnx as ox
+        folder, name = os.path.split(filename)
+        if name.endswith('.graphml'):
+            G = ox.load_graphml(name, folder=folder)
+        else:
+            G = ox.graph_from_file(filename, network_type=network_type)
+        store = cls.from_graph(G)
+        store.save(path)
+        return store
+
+    @classmethod
+    def from_graph(cls, G):
+        """
+        Convert a networkx graph with osmnx style node attributes to arrays.
+        Parallel edges are collapsed keeping the shortest one.
+
+        Args:
+            G <graph object>: map of city
+
+        Returns:
+            GraphStore
+        """
+        nodes = list(G.nodes())
+        index = {n: i for i, n in enumerate(nodes)}
+        node_ids = np.array([G.nodes[n].get('osmid', n) for n in nodes], dtype=np.int64)
+        x = np.array([G.nodes[n]['x'] for n in nodes], dtype=np.float64)
+        y = np.array([G.nodes[n]['y'] for n in nodes], dtype=np.float64)
+
+        adjacency = [{} for _ in nodes]
+        west, south, east, north = np.inf, np.inf, -np.inf, -np.inf
+        for u, v, data in G.edges(data=True):
+            ui, vi = index[u], index[v]
+            length = data.get('length', 1.0)
+            if length < adjacency[ui].get(vi, (np.inf,))[0]:
+                adjacency[ui][vi] = (length, cls.edge_speed(data))
+            # edge extent comes from its geometry if present, otherwise from its end points
+            if 'geometry' in data:
+                minx, miny, maxx, maxy = data['geometry'].bounds
+            else:
+                minx, maxx = sorted((x[ui], x[vi]))
+                miny, maxy = sorted((y[ui], y[vi]))
+            west, south = min(west, minx), min(south, miny)
+            east, north = max(east, maxx), max(north, maxy)
+        if west > east:
+            west, south, east, north = x.min(), y.min(), x.max(), y.max()
+
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(adj) for adj in adjacency])
+        indices = np.fromiter((v for adj in adjacency for v in adj), dtype=np.int64, count=indptr[-1])
+        lengths = np.fromiter((length for adj in adjacency for length, _ in adj.values()), dtype=np.float64,
+                              count=indptr[-1])
+        speeds = np.fromiter((speed for adj in adjacency for _, speed in adj.values()), dtype=np.float64,
+                             count=indptr[-1])
+        return cls(node_ids, x, y, indptr, indices, lengths, (west, south, east, north), speeds=speeds)
+
+    @classmethod
+    def edge_speed(cls, data):
+        """
+        Speed of an osmnx edge from its maxspeed tag, or from its highway type.
+        Both can be lists when osmnx merged several ways into one edge.
+
+        Returns:
+            float: speed in km/h
+        """
+        maxspeed = data.get('maxspeed')
+        for value in (maxspeed if isinstance(maxspeed, list) else [maxspeed]):
+            if not value:
+                continue
+            number = str(value).split()[0]
+            try:
+                speed = float(number)
+            except ValueError:
+                continue
+            return speed * cls.MPH if 'mph' in str(value) else speed
+        highway = data.get('highway')
+        for value in (highway if isinstance(highway, list) else [highway]):
+            if value is not None:
+                speed = cls.HIGHWAY_SPEEDS.get(value.replace('_link', ''))
+                if speed:
+                    return float(speed)
+        return float(cls.DEFAULT_SPEED)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory-map a store previously written by save.
+
+        Args:
+            path str: store directory
+
+        Returns:
+            GraphStore
+        """
+        with open(os.path.join(path, cls.META)) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in cls.ARRAYS]
+        optional = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in cls.OPTIONAL
+                    if os.path.exists(os.path.join(path, name + '.npy'))}
+        return cls(*arrays, bounds=meta['bounds'], path=path, **optional)
+
+    def save(self, path):
+        """
+        Write arrays and metadata to a directory. The directory is written
+        aside and renamed into place, so concurrent readers never see a
+        partial store.
+
+        Args:
+            path str: store directory
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        for name in GraphStore.ARRAYS + GraphStore.OPTIONAL:
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(tmp, GraphStore.META), 'w') as f:
+            json.dump({'bounds': [float(b) for b in self.bounds], 'nodes': len(self)}, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # another process cached the same graph first
+            shutil.rmtree(tmp)
+        self.path = path
+
+    @contextlib.contextmanager
+    def shared(self):
+        """
+        Context giving a directory worker processes can memory-map the store
+        from instead of receiving a copy. A store that was never saved is
+        written to a temporary directory, which is removed again on exit.
+
+        Yields:
+            str: store directory
+        """
+        if self.path is not None:
+            yield self.path
+            return
+        folder = tempfile.mkdtemp()
+        try:
+            self.save(os.path.join(folder, 'graph'))
+            yield self.path
+        finally:
+            self.path = None
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def index(self, osmid):
+        return self.node_index[osmid]
+
+    def node(self, osmid):
+        """
+        Returns:
+            dict: osmnx attributes of a node used by the simulation, as in to_networkx
+        """
+        i = self.index(osmid)
+        return {'osmid': int(self.node_ids[i]), 'x': float(self.x[i]), 'y': float(self.y[i])}
+
+    def neighbours(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def edge_count(self):
+        return len(self.indices)
+
+    def travel_times(self):
+        """
+        Returns:
+            array(float): seconds to drive each edge
+        """
+        return self.lengths / (self.speeds / 3.6)
+
+    def to_networkx(self):
+        """
+        Build a networkx graph with the osmnx node attributes used by the
+        simulation (x, y, osmid) and edge lengths and speeds.
+
+        Returns:
+            <graph object>: map of city
+        """
+        import networkx as nx
+        G = nx.MultiDiGraph()
+        node_ids = self.node_ids.tolist()
+        G.add_nodes_from((osmid, {'osmid': osmid, 'x': x, 'y': y}) for osmid, x, y in
+                         zip(node_ids, self.x.tolist(), self.y.tolist()))
+        sources = np.repeat(np.arange(len(self)), np.diff(self.indptr)).tolist()
+        G.add_edges_from((node_ids[u], node_ids[v], {'length': length, 'maxspeed': speed})
+                         for u, v, length, speed in
+                         zip(sources, self.indices.tolist(), self.lengths.tolist(), self.speeds.tolist()))
+        return G
@@ -1,17 +1,143 @@
-import random
+import argparse
 import sys
-from itertools import chain
 
-from bounce_simulation import BounceSimulation
-from visualize_data import VisualizeData
+# modules pulling in osmnx, matplotlib or networkx are imported by the commands that need them, so
+# headless commands do not pay for them at start up
+
+
+def load_scenario(args):
+    from scenario_config import ScenarioConfig
+
+    return ScenarioConfig.load(args.scenario) if args.scenario else ScenarioConfig({})
+
+
+def simulate(args):
+    """
+    Run a scenario without rendering and print the metrics of its last turn.
+    """
+    from snapshot import Snapshot
+
+    scenario = load_scenario(args)
+    engine = scenario.engine(score_func=args.strategy, seed=args.seed)
+    if args.restore:
+        engine.restore(Snapshot.load(args.restore))
+    recorder = None
+    if args.metrics:
+        from metrics_recorder import MetricsRecorder
+        recorder = MetricsRecorder(args.metrics)
+        engine.add_observer(recorder)
+    profiler = engine.profile() if args.profile else None
+    metrics = engine.run(args.turns or scenario.turns)
+    if recorder is not None:
+        recorder.close()
+    if args.checkpoint:
+        engine.snapshot().save(args.checkpoint)
+    if metrics:
+        for name, value in metrics[-1]._asdict().items():
+            print("{:<20}{}".format(name, value))
+    if profiler is not None:
+        print(profiler.format_summary())
+
+
+def render(args):
+    """
+    Animate a scenario into gif files, or into numbered png files with
+    renderer processes when an output directory is given.
+    """
+    scenario = load_scenario(args)
+    if args.output:
+        from pipeline import RenderPipeline
+
+        engine = scenario.engine(score_func=args.strategy, seed=args.seed)
+        pipeline = RenderPipeline(engine, args.output, renderers=args.renderers, render=args.render)
+        pipeline.run(args.turns or scenario.turns)
+        print("rendered {} frames, dropped {}".format(pipeline.sent, pipeline.dropped))
+        return
+
+    from bounce_simulation import BounceSimulation
+    from export import export_animation
+    from visualize_data import VisualizeData
+
+    frames = args.turns or scenario.config.get('turns', BounceSimulation.FRAMES)
+    simulation = BounceSimulation(frames=frames, render=args.render,
+                                  engine=scenario.engine(score_func=args.strategy, seed=args.seed))
+    ext = '.gif' if args.writer == 'pillow' else '.mp4'
+    options = {'fps': args.fps, 'dpi': args.dpi, 'writer': args.writer}
+    # frames are streamed to disk instead of being buffered for a single save, gif files are numbered
+    export_animation(simulation.fig, simulation.update_plot, frames, 'bounce_simulation' + ext,
+                     init=simulation.setup_plot, every=args.every, **options)
+    simulation.recorder.close()
+    visualize = VisualizeData(simulation.recorder)
+    export_animation(visualize.fig, visualize.animate, visualize.frames, 'data_simulation' + ext,
+                     init=visualize.setup_plot, every=args.every, **options)
+
+
+def sweep(args):
+    from sweep import run_sweep
+
+    run_sweep(args.config)
+
+
+def bench(args):
+    import benchmark
+
+    return 1 if benchmark.main(args.output, args.baseline, args.scales, args.turns, args.hubs) else 0
+
+
+def parser():
+    """
+    Returns:
+        argparse.ArgumentParser: parser of all commands
+    """
+    main_parser = argparse.ArgumentParser(description="Scooter and truck fleet simulation.")
+    commands = main_parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    scenario = argparse.ArgumentParser(add_help=False)
+    scenario.add_argument('scenario', nargs='?', help="scenario json file, see ScenarioConfig, defaults if missing")
+    scenario.add_argument('--strategy', help="scoring for trucks, the one of the scenario if missing")
+    scenario.add_argument('--seed', type=int, help="seed of all random draws, the one of the scenario or "
+                                                   "ScenarioConfig.SEED if missing")
+    scenario.add_argument('--turns', type=int, help="turns to run")
+
+    command = commands.add_parser('simulate', parents=[scenario], help="run a scenario without rendering")
+    command.add_argument('--metrics', help="directory to stream per turn metrics to")
+    command.add_argument('--profile', action='store_true', help="print time spent in each phase")
+    command.add_argument('--checkpoint', help="file to save a snapshot to after the last turn")
+    command.add_argument('--restore', help="snapshot file to continue from")
+    command.set_defaults(run=simulate)
+
+    command = commands.add_parser('render', parents=[scenario], help="animate a scenario")
+    command.add_argument('--render', choices=('points', 'density'), default='points',
+                         help="draw a point per scooter or scooters binned on a grid")
+    command.add_argument('--output', help="directory to write png frames to with renderer processes, "
+                                          "gif files in the current directory if missing")
+    command.add_argument('--renderers', type=int, default=2, help="renderer processes for png frames")
+    command.add_argument('--writer', choices=('pillow', 'ffmpeg'), default='pillow',
+                         help="numbered gif files with pillow or one mp4 file with ffmpeg")
+    command.add_argument('--fps', type=int, default=10, help="frames per second of the animation")
+    command.add_argument('--dpi', type=int, default=100, help="resolution of the animation")
+    command.add_argument('--every', type=int, default=1, help="capture one frame every this many turns")
+    command.set_defaults(run=render)
+
+    command = commands.add_parser('sweep', help="run a parameter sweep over a process pool")
+    command.add_argument('config', help="sweep json file, see sweep.py")
+    command.set_defaults(run=sweep)
+
+    command = commands.add_parser('bench', help="run the synthetic benchmark suite")
+    command.add_argument('output', help="file to write results to")
+    command.add_argument('baseline', nargs='?', help="results to compare with, exits with 1 on regressions")
+    command.add_argument('--scales', nargs='+', default=['small', 'medium'], help="city sizes to run")
+    command.add_argument('--turns', type=int, default=200, help="turns per strategy")
+    command.add_argument('--hubs', type=int, nargs='+', default=[1, 3], help="transit hubs of every city")
+    command.set_defaults(run=bench)
+    return main_parser
+
 
 if __name__ == "__main__":
     """
-    Pass 'greedy', 'aging' or 'combined' as input argument, to choose
-    scoring function
+    Run 'python main.py <command> --help' for the options of a command, e.g.
+    'python main.py simulate scenario.json --strategy greedy'.
     """
-    random.seed(25)
-    simulation = BounceSimulation(score_func=sys.argv[1])
-    simulation.ani.save('bounce_simulation.gif', writer='imagemagick', fps=10)
-    visualize = VisualizeData(list(chain.from_iterable(simulation.data)))
-    visualize.ani.save('data_simulation.gif', writer='imagmagick', fps=10)
+    arguments = parser().parse_args()
+    sys.exit(arguments.run(arguments))
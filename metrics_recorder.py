@@ -0,0 +1,145 @@
+import json
+import os
+
+import numpy as np
+
+
+class MetricsRecorder:
+    # name, dtype and whether the column holds one value per office or truck
+    COLUMNS = [
+        ('turn', np.int64, None),
+        ('avg_waiting_time', np.float64, None),
+        ('customers_dropped', np.int64, None),
+        ('under_utilization', np.float64, None),
+        ('truck_utilization', np.float64, None),
+        ('office_scooters', np.int64, 'offices'),
+        ('truck_load', np.int64, 'trucks'),
+    ]
+    META = 'meta.json'
+
+    def __init__(self, path=None, chunk_size=4096):
+        """
+        Stores per turn metrics in typed columns. With a path, rows are kept in
+        a buffer of chunk_size rows that is appended to one raw file per column
+        whenever it fills up, so memory stays constant however long the run.
+        Without a path the buffer grows and everything stays in memory.
+
+        Args:
+            path str: directory to write columns to, None to keep them in memory
+            chunk_size int: rows buffered between flushes
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.widths = None
+        self.buffers = None
+        self.size = 0  # rows in buffer
+        self.flushed = 0  # rows written to disk
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def __call__(self, engine, metrics):
+        """
+        Observer for the simulation engine, records the finished turn.
+        """
+        self.record(metrics, engine.scooters.scooters_office, engine.trucks.truck_cap)
+
+    def __len__(self):
+        return self.flushed + self.size
+
+    def allocate(self, offices, trucks):
+        per = {'offices': offices, 'trucks': trucks, None: None}
+        self.widths = {name: per[width] for name, _, width in MetricsRecorder.COLUMNS}
+        self.buffers = {name: np.zeros(self.shape(name, self.chunk_size), dtype=dtype)
+                        for name, dtype, _ in MetricsRecorder.COLUMNS}
+        if self.path:
+            for name, _, _ in MetricsRecorder.COLUMNS:
+                open(self.column_file(self.path, name), 'wb').close()
+            self.write_meta()
+
+    def shape(self, name, rows):
+        width = self.widths[name]
+        return (rows,) if width is None else (rows, width)
+
+    def record(self, metrics, office_scooters, truck_load):
+        """
+        Args:
+            metrics TurnMetrics: metrics logged for the turn
+            office_scooters List(int): scooters parked at each office
+            truck_load List(int): scooters carried by each truck
+        """
+        if self.buffers is None:
+            self.allocate(len(office_scooters), len(truck_load))
+        if self.size == len(self.buffers['turn']):
+            if self.path:
+                self.flush()
+            else:
+                for name, buf in self.buffers.items():
+                    grown = np.zeros(self.shape(name, 2 * len(buf)), dtype=buf.dtype)
+                    grown[:len(buf)] = buf
+                    self.buffers[name] = grown
+        row = metrics._asdict()
+        row['office_scooters'] = office_scooters
+        row['truck_load'] = truck_load
+        for name, buf in self.buffers.items():
+            buf[self.size] = row[name]
+        self.size += 1
+
+    def flush(self):
+        """
+        Append buffered rows to the column files.
+        """
+        if not self.path or not self.size:
+            return
+        for name, buf in self.buffers.items():
+            with open(self.column_file(self.path, name), 'ab') as f:
+                f.write(buf[:self.size].tobytes())
+        self.flushed += self.size
+        self.size = 0
+        self.write_meta()
+
+    def close(self):
+        self.flush()
+
+    def write_meta(self):
+        columns = {name: {'dtype': np.dtype(dtype).str, 'width': self.widths[name]}
+                   for name, dtype, _ in MetricsRecorder.COLUMNS}
+        with open(os.path.join(self.path, MetricsRecorder.META), 'w') as f:
+            json.dump({'rows': self.flushed, 'columns': columns}, f)
+
+    def column(self, name):
+        """
+        All recorded values of a column, flushed rows followed by buffered ones.
+
+        Returns:
+            array: one value, or one row of per office or per truck values, per turn
+        """
+        if self.buffers is None:
+            return np.zeros(0)
+        buffered = self.buffers[name][:self.size]
+        if not self.flushed:
+            return buffered.copy()
+        return np.concatenate((MetricsRecorder.load(self.path, name), buffered))
+
+    @staticmethod
+    def column_file(path, name):
+        return os.path.join(path, name + '.bin')
+
+    @staticmethod
+    def load(path, name):
+        """
+        Memory-map one column written by a recorder, without reading the others.
+
+        Args:
+            path str: directory the recorder wrote to
+            name str: column name
+
+        Returns:
+            <numpy memmap>: column values
+        """
+        with open(os.path.join(path, MetricsRecorder.META)) as f:
+            meta = json.load(f)
+        column = meta['columns'][name]
+        shape = (meta['rows'],) if column['width'] is None else (meta['rows'], column['width'])
+        if not meta['rows']:
+            return np.zeros(shape, dtype=column['dtype'])
+        return np.memmap(MetricsRecorder.column_file(path, name), dtype=column['dtype'], mode='r', shape=shape)
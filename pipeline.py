@@ -0,0 +1,271 @@
+import contextlib
+import os
+import queue
+from collections import namedtuple
+from multiprocessing import Process, Queue
+
+import numpy as np
+
+from graph_store import GraphStore
+
+# everything a renderer needs to draw one turn, positions are x, y rows, density is scooters per grid cell
+Frame = namedtuple('Frame', ['turn', 'scooter_xy', 'scooter_size', 'truck_xy', 'truck_size', 'history', 'density'])
+METRICS = ['avg_waiting_time', 'customers_dropped', 'under_utilization', 'truck_utilization']
+TITLES = ["Average customer waiting time", "Customers dropped with time",
+          "Average idle state per scooter per turn", "Average truck utilzation"]
+
+
+def _render_worker(frames, store_path, office_ids, metro_id, views, output, dpi, render):
+    """
+    Entry point of a renderer process, draws frames until it receives None.
+    """
+    renderer = FrameRenderer(GraphStore.load(store_path), office_ids, metro_id, views, output, dpi, render)
+    for frame in iter(frames.get, None):
+        renderer.render(frame)
+
+
+class FrameRenderer:
+    FIG_HEIGHT = 12  # inches, width follows from the aspect ratio of the map
+    CHART_SIZE = (13, 7)  # inches
+
+    def __init__(self, store, office_ids, metro_id, views, output, dpi, render='points'):
+        """
+        Draws frames off screen into numbered png files, map_<turn>.png for
+        scooters and trucks over the road layer and chart_<turn>.png for the
+        metrics. Runs in a renderer process, figures are never shown.
+
+        Args:
+            store GraphStore: road network arrays
+            office_ids List(int): osm ids of office nodes
+            metro_id int or List(int): osm id of metro node, or osm ids of all transit hubs
+            views List(str): 'map' and/or 'chart'
+            output str: directory to write images to
+            dpi int: resolution of images
+            render str: 'points' or 'density', see BounceSimulation
+        """
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        from density_layer import DensityLayer
+        from road_layer import RoadLayer
+
+        self.output = output
+        self.dpi = dpi
+        self.map = None
+        self.chart = None
+        if 'map' in views:
+            west, south, east, north = store.bounds
+            height = FrameRenderer.FIG_HEIGHT
+            fig = Figure(figsize=(height * (east - west) / (north - south), height), dpi=dpi, facecolor='w')
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot(111)
+            # if the graph is not projected, conform the aspect ratio to not stretch the plot
+            ax.set_aspect(1. / np.cos((store.y.min() + store.y.max()) / 2. / 180. * np.pi))
+            road_layer = RoadLayer(store, office_ids, metro_id)
+            road_layer.draw(ax)
+            ax.get_xaxis().get_major_formatter().set_useOffset(False)
+            ax.get_yaxis().get_major_formatter().set_useOffset(False)
+            empty = np.empty(0)
+            if render == 'density':
+                scooters = DensityLayer(store, road_layer.extent())
+                scooters.draw(ax)
+            else:
+                scooters = ax.scatter(empty, empty, c=empty, alpha=0.6, edgecolor=None, zorder=10, cmap='gnuplot')
+            self.map = (fig, ax.text(0.02, 0.98, "", transform=ax.transAxes, va='top', zorder=20), scooters,
+                        ax.scatter(empty, empty, c=empty, alpha=0.6, edgecolor=None, zorder=15, cmap='plasma'))
+        if 'chart' in views:
+            fig = Figure(figsize=FrameRenderer.CHART_SIZE, dpi=dpi)
+            FigureCanvasAgg(fig)
+            axes = [fig.add_subplot(2, 2, k + 1) for k in range(len(METRICS))]
+            for ax, title in zip(axes, TITLES):
+                ax.set_title(title)
+            fig.subplots_adjust(top=0.92, bottom=0.08, left=0.10, right=0.95, hspace=0.25, wspace=0.35)
+            self.chart = (fig, axes, [ax.plot([], [])[0] for ax in axes])
+
+    def render(self, frame):
+        if self.map is not None:
+            fig, text, scooters, trucks = self.map
+            text.set_text("Turn {}".format(frame.turn))
+            points = [(trucks, frame.truck_xy, frame.truck_size)]
+            if frame.density is not None:
+                scooters.update(frame.density)
+            else:
+                points.append((scooters, frame.scooter_xy, frame.scooter_size))
+            for artist, xy, size in points:
+                artist.set_offsets(xy)
+                artist.set_sizes(size)
+                artist.set_array(size)
+                artist.set_clim(size.min(), size.max())
+            fig.savefig(os.path.join(self.output, 'map_{:06d}.png'.format(frame.turn)), dpi=self.dpi)
+        if self.chart is not None and frame.history is not None:
+            fig, axes, lines = self.chart
+            turns = frame.history[:, 0]
+            for k, (ax, line) in enumerate(zip(axes, lines)):
+                line.set_data(turns, frame.history[:, k + 1])
+                ax.relim()
+                ax.autoscale_view()
+            fig.savefig(os.path.join(self.output, 'chart_{:06d}.png'.format(frame.turn)), dpi=self.dpi)
+
+
+class RenderPipeline:
+    POLICIES = ('block', 'drop', 'decimate')
+    QUEUE_SIZE = 16  # frames waiting for a renderer
+    HISTORY_POINTS = 1000  # metric points sent with a frame, older history is thinned out beyond this
+
+    def __init__(self, engine, output, renderers=2, views=('map', 'chart'), policy='decimate', every=1,
+                 queue_size=QUEUE_SIZE, dpi=100, render='points'):
+        """
+        Decouples simulation from drawing. The engine runs in this process and
+        an observer turns every rendered turn into a compact Frame of
+        positions, sizes and metric history, which goes into a bounded queue
+        shared by renderer processes. Each renderer keeps its own figures and
+        writes the frames it takes as images, so maps and charts are drawn on
+        several cores while the simulation runs ahead.
+
+        When the queue is full the policy decides: 'block' waits for a
+        renderer, 'drop' skips the frame, 'decimate' skips it and doubles the
+        number of turns between rendered frames from then on.
+
+        With render 'density' a frame carries scooters binned on a grid
+        instead of a position per scooter, so its size does not depend on the
+        fleet.
+
+        Args:
+            engine SimulationEngine: simulation to render, scooter positions need the turn based engine
+            output str: directory for the images
+            renderers int: number of renderer processes
+            views List(str): 'map' for scooters and trucks, 'chart' for metrics
+            policy str: 'block', 'drop' or 'decimate'
+            every int: render one turn out of every this many
+            queue_size int: frames that can wait for a renderer
+            dpi int: resolution of images
+            render str: 'points' or 'density', see BounceSimulation
+        """
+        if policy not in RenderPipeline.POLICIES:
+            raise ValueError("policy must be one of {}".format(", ".join(RenderPipeline.POLICIES)))
+        if not engine.FLEET:
+            raise ValueError("{} does not keep scooter positions and cannot be rendered".format(type(engine).__name__))
+        os.makedirs(output, exist_ok=True)
+        self.engine = engine
+        self.output = output
+        self.renderers = renderers
+        self.views = list(views)
+        self.policy = policy
+        self.every = every
+        self.dpi = dpi
+        self.render = render
+        self.density = None
+        if render == 'density' and 'map' in self.views:
+            from density_layer import DensityLayer
+            from road_layer import RoadLayer
+
+            road_layer = RoadLayer(engine.store, engine.office_ids, engine.hub_ids)
+            self.density = DensityLayer(engine.store, road_layer.extent())
+        self.frames = Queue(queue_size)
+        self.workers = []
+        self.resources = contextlib.ExitStack()  # store directory shared with the renderers
+        self.history = []  # (turn, metrics) of every turn
+        self.sent = 0
+        self.dropped = 0
+        engine.add_observer(self)
+
+    def start(self):
+        # renderers memory-map the graph instead of receiving a copy
+        store_path = self.resources.enter_context(self.engine.store.shared())
+        for _ in range(self.renderers):
+            worker = Process(target=_render_worker, args=(self.frames, store_path, self.engine.office_ids,
+                                                          self.engine.hub_ids, self.views, self.output, self.dpi,
+                                                          self.render),
+                             daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def thinned_history(self):
+        """
+        Returns:
+            array(float32): rows of turn and metrics, at most HISTORY_POINTS plus the newest turn
+        """
+        step = len(self.history) // RenderPipeline.HISTORY_POINTS + 1
+        rows = self.history[::step]
+        if (len(self.history) - 1) % step:
+            rows.append(self.history[-1])
+        return np.array(rows, dtype=np.float32)
+
+    def frame(self, engine, metrics):
+        history = self.thinned_history() if 'chart' in self.views else None
+        if 'map' not in self.views:
+            return Frame(metrics.turn, None, None, None, None, history, None)
+        truck_x, truck_y = engine.trucks.get_pos()
+        trucks = (np.c_[truck_x, truck_y].astype(np.float32), np.asarray(engine.trucks.get_size(), dtype=np.float32))
+        if self.density is not None:
+            density = self.density.histogram(*engine.scooters.node_counts()).astype(np.float32)
+            return Frame(metrics.turn, None, None, *trucks, history, density)
+        x, y = engine.scooters.node_positions()
+        return Frame(metrics.turn, np.c_[x, y].astype(np.float32),
+                     np.asarray(engine.scooters.node_size(), dtype=np.float32), *trucks, history, None)
+
+    def __call__(self, engine, metrics):
+        """
+        Observer for the simulation engine, queues the finished turn for rendering.
+        """
+        self.history.append([metrics.turn] + [getattr(metrics, name) for name in METRICS])
+        if metrics.turn % self.every:
+            return
+        frame = self.frame(engine, metrics)
+        if self.policy == 'block':
+            self.frames.put(frame)
+        else:
+            try:
+                self.frames.put_nowait(frame)
+            except queue.Full:
+                self.dropped += 1
+                if self.policy == 'decimate':
+                    self.every *= 2
+                return
+        self.sent += 1
+
+    def run(self, n_turns):
+        """
+        Simulate and render, waiting for the renderers to finish.
+
+        Returns:
+            List(TurnMetrics): metrics for each turn
+        """
+        if not self.workers:
+            self.start()
+        try:
+            return self.engine.run(n_turns)
+        finally:
+            self.close()
+
+    def close(self):
+        for _ in self.workers:
+            self.frames.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        self.resources.close()
+
+    def files(self, view='map'):
+        """
+        Returns:
+            List(str): images of a view in turn order
+        """
+        prefix = view + '_'
+        return sorted(os.path.join(self.output, name) for name in os.listdir(self.output) if name.startswith(prefix))
+
+
+if __name__ == "__main__":
+    """
+    Pass the scoring function and the directory to write images to, and
+    optionally the number of turns and of renderer processes.
+    """
+    import random
+    import sys
+
+    from simulation_engine import SimulationEngine
+
+    random.seed(25)
+    engine = SimulationEngine(SimulationEngine.load_store(), score_func=sys.argv[1])
+    pipeline = RenderPipeline(engine, sys.argv[2], renderers=int(sys.argv[4]) if len(sys.argv) > 4 else 2)
+    pipeline.run(int(sys.argv[3]) if len(sys.argv) > 3 else 100)
+    print("rendered {} frames, dropped {}".format(pipeline.sent, pipeline.dropped))
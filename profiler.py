@@ -0,0 +1,137 @@
+import csv
+import json
+import time
+
+
+class PhaseProfiler:
+    TURN = 'turn'  # phase covering the whole turn
+
+    def __init__(self):
+        """
+        Wall time and call counts per phase for every turn. Phases are methods
+        replaced by timed wrappers with instrument, an engine without a
+        profiler attached runs its methods unwrapped. A phase called from
+        within itself, e.g. a routing query falling back to another one, is
+        timed once. Phases called from other phases, e.g. routing during
+        planning, are also counted in the phase calling them.
+        """
+        self.phases = [PhaseProfiler.TURN]  # names in order of instrumenting
+        self.counters = {}  # name -> callable returning a running count
+        self.seconds = {}  # phase -> seconds spent in current turn
+        self.calls = {}  # phase -> calls in current turn
+        self.active = set()  # phases currently being timed
+        self.last_counts = {}
+        self.timeline = []  # (turn, seconds, calls, counter increments) of finished turns
+
+    def instrument(self, owner, attribute, phase):
+        """
+        Time every call of owner.attribute as the given phase. With phase TURN
+        the call ends a turn, the wrapped method has to return TurnMetrics.
+
+        Args:
+            owner: object whose method is replaced
+            attribute str: method name
+            phase str: name of the phase
+        """
+        func = getattr(owner, attribute)
+        if phase not in self.phases:
+            self.phases.append(phase)
+
+        def timed(*args, **kwargs):
+            if phase in self.active:
+                return func(*args, **kwargs)
+            self.active.add(phase)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                self.seconds[phase] = self.seconds.get(phase, 0.) + time.perf_counter() - start
+                self.calls[phase] = self.calls.get(phase, 0) + 1
+                self.active.discard(phase)
+            if phase == PhaseProfiler.TURN:
+                self.end_turn(result.turn)
+            return result
+
+        setattr(owner, attribute, timed)
+
+    def add_counter(self, name, read):
+        """
+        Record how much a running count grew in every turn.
+
+        Args:
+            name str: column name
+            read: callable returning the count
+        """
+        self.counters[name] = read
+        self.last_counts[name] = read()
+
+    def end_turn(self, turn):
+        counts = {name: read() for name, read in self.counters.items()}
+        increments = {name: counts[name] - self.last_counts[name] for name in counts}
+        self.last_counts = counts
+        self.timeline.append((turn, self.seconds, self.calls, increments))
+        self.seconds, self.calls = {}, {}
+
+    def columns(self):
+        names = ['turn']
+        for phase in self.phases:
+            names += [phase + '_seconds', phase + '_calls']
+        return names + list(self.counters)
+
+    def rows(self):
+        """
+        Returns:
+            generator(List): one row per turn, in the order of columns
+        """
+        for turn, seconds, calls, increments in self.timeline:
+            row = [turn]
+            for phase in self.phases:
+                row += [seconds.get(phase, 0.), calls.get(phase, 0)]
+            yield row + [increments.get(name, 0) for name in self.counters]
+
+    def summary(self):
+        """
+        Totals per phase over all turns, with the turn the phase was slowest in.
+
+        Returns:
+            List(dict): phase, seconds, share of turn time, calls, ms per call, slowest turn and its ms
+        """
+        total = sum(seconds.get(PhaseProfiler.TURN, 0.) for _, seconds, _, _ in self.timeline)
+        result = []
+        for phase in self.phases:
+            spent = [(seconds.get(phase, 0.), turn) for turn, seconds, _, _ in self.timeline]
+            calls = sum(calls.get(phase, 0) for _, _, calls, _ in self.timeline)
+            seconds = sum(s for s, _ in spent)
+            worst, worst_turn = max(spent) if spent else (0., None)
+            result.append({'phase': phase, 'seconds': seconds, 'share': seconds / total if total else 0.,
+                           'calls': calls, 'ms_per_call': 1000 * seconds / calls if calls else 0.,
+                           'slowest_turn': worst_turn, 'slowest_ms': 1000 * worst})
+        return result
+
+    def format_summary(self):
+        """
+        Returns:
+            str: summary as a text table
+        """
+        lines = ["{:<24}{:>10}{:>8}{:>10}{:>12}{:>14}{:>12}".format(
+            'phase', 'seconds', 'share', 'calls', 'ms/call', 'slowest turn', 'slowest ms')]
+        for row in self.summary():
+            lines.append("{phase:<24}{seconds:>10.3f}{share:>8.1%}{calls:>10}{ms_per_call:>12.3f}"
+                         "{slowest_turn!s:>14}{slowest_ms:>12.3f}".format(**row))
+        for name in self.counters:
+            lines.append("{:<24}{:>10}".format(name, sum(increments.get(name, 0) for *_, increments in
+                                                         self.timeline)))
+        return "\n".join(lines)
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns())
+            writer.writerows(self.rows())
+
+    def write_json(self, path):
+        """
+        Timeline and summary as one JSON document.
+        """
+        with open(path, 'w') as f:
+            json.dump({'columns': self.columns(), 'timeline': list(self.rows()), 'summary': self.summary()}, f)
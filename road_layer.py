@@ -0,0 +1,117 @@
+import os
+
+import numpy as np
+
+
+class RoadLayer:
+    ROAD_COLOR = '#999999'
+    OFFICE_COLOR = 'blue'
+    METRO_COLOR = 'red'
+    MARGIN = 0.02  # fraction of map size left around the roads
+    DPI = 200  # resolution of the cached raster
+
+    def __init__(self, store, offices, metro):
+        """
+        Static part of the map: roads, office and hub markers and the axis
+        extent. The layer is rasterized once and the image is cached next to the
+        graph store, so a frame only draws one image however large the network.
+
+        Args:
+            store GraphStore: road network arrays
+            offices List(int): osm ids of office nodes
+            metro int or List(int): osm id of metro node, or osm ids of all transit hubs
+        """
+        self.store = store
+        self.offices = [store.index(osmid) for osmid in offices]
+        hubs = metro if isinstance(metro, (list, tuple)) else [metro]
+        self.hubs = [store.index(osmid) for osmid in hubs]
+        self.metro = self.hubs[0]
+        self.image = None
+
+    def segments(self):
+        """
+        Every edge as a straight line from node to node, built without a Python loop.
+
+        Returns:
+            array(float): edges x 2 points x (x, y)
+        """
+        store = self.store
+        sources = np.repeat(np.arange(len(store)), np.diff(store.indptr))
+        points = np.c_[store.x, store.y]
+        return np.stack((points[sources], points[store.indices]), axis=1)
+
+    def extent(self):
+        """
+        Returns:
+            (float, float, float, float): west, east, south and north limits of the axis
+        """
+        west, south, east, north = self.store.bounds
+        margin_ns = (north - south) * RoadLayer.MARGIN
+        margin_ew = (east - west) * RoadLayer.MARGIN
+        return west - margin_ew, east + margin_ew, south - margin_ns, north + margin_ns
+
+    def cache_file(self, width, height):
+        if self.store.path is None:
+            return None
+        hubs = self.metro if len(self.hubs) == 1 else tuple(self.hubs)
+        key = self.store.cache_key(width, height, hubs, tuple(self.offices))
+        return os.path.join(self.store.path, 'background_{}.npy'.format(key))
+
+    def rasterize(self, width, height):
+        """
+        Draw the layer off screen.
+
+        Args:
+            width int: image width in pixels
+            height int: image height in pixels
+
+        Returns:
+            array(uint8): height x width x RGBA image
+        """
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.collections import LineCollection
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=(width / RoadLayer.DPI, height / RoadLayer.DPI), dpi=RoadLayer.DPI)
+        canvas = FigureCanvasAgg(fig)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.axis('off')
+        ax.add_collection(LineCollection(self.segments(), colors=RoadLayer.ROAD_COLOR, linewidths=1, alpha=1,
+                                         zorder=2))
+        x, y = self.store.x, self.store.y
+        ax.plot(x[self.offices], y[self.offices], 'o', color=RoadLayer.OFFICE_COLOR, zorder=3)
+        ax.plot(x[self.hubs], y[self.hubs], 'o', color=RoadLayer.METRO_COLOR, zorder=3)
+        west, east, south, north = self.extent()
+        ax.set_xlim(west, east)
+        ax.set_ylim(south, north)
+        canvas.draw()
+        return np.asarray(canvas.buffer_rgba()).copy()
+
+    def load(self, width, height):
+        """
+        Rasterized layer of the given size, from the cache when possible.
+        """
+        path = self.cache_file(width, height)
+        if path and os.path.exists(path):
+            return np.load(path)
+        image = self.rasterize(width, height)
+        if path:
+            np.save(path, image)
+        return image
+
+    def draw(self, ax):
+        """
+        Show the layer as a single image behind everything else on the axis,
+        sized to the axis in inches at DPI. Aspect ratio of the axis should be
+        set before.
+        """
+        west, east, south, north = self.extent()
+        ax.set_xlim(west, east)
+        ax.set_ylim(south, north)
+        ax.apply_aspect()
+        bbox = ax.get_window_extent().transformed(ax.figure.dpi_scale_trans.inverted())
+        width, height = int(bbox.width * RoadLayer.DPI), int(bbox.height * RoadLayer.DPI)
+        self.image = self.load(width, height)
+        # keep the aspect set by the caller, imshow would otherwise replace it
+        ax.imshow(self.image, extent=(west, east, south, north), aspect=ax.get_aspect(), interpolation='bilinear',
+                  zorder=1)
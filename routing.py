@@ -0,0 +1,567 @@
+import heapq
+import json
+import os
+import shutil
+import tempfile
+from collections import deque
+
+import numpy as np
+
+
+class NoPathError(ValueError):
+    pass
+
+
+class RoutingIndex:
+    UNREACHABLE = -1
+
+    def __init__(self, store, fixed_points):
+        """
+        Precompute one shortest path tree per fixed point (metro and offices) in
+        both directions, so that any node to fixed point query is a table lookup.
+        Every edge counts as one step, as in the rest of the simulation.
+
+        Args:
+            store GraphStore: road network arrays
+            fixed_points List(int): osm ids of metro and office nodes
+        """
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        n = len(store)
+        self.rev_indptr, self.rev_indices, _ = self.reverse(store)
+
+        forward = (store.indptr.tolist(), store.indices.tolist())
+        backward = (self.rev_indptr.tolist(), self.rev_indices.tolist())
+        self.fixed = {}  # osm id -> row in tables
+        self.dist_from, self.parent_from = [], []  # trees rooted at fixed point
+        self.dist_to, self.next_to = [], []  # trees leading into fixed point
+        for osmid in fixed_points:
+            if osmid in self.fixed:
+                continue
+            root = store.index(osmid)
+            self.fixed[osmid] = len(self.dist_from)
+            dist, parent = self.bfs(root, *forward)
+            self.dist_from.append(dist)
+            self.parent_from.append(parent)
+            dist, parent = self.bfs(root, *backward)
+            self.dist_to.append(dist)
+            self.next_to.append(parent)
+        self.rows = {store.index(osmid): row for osmid, row in self.fixed.items()}  # node position -> row
+        self.dist_from = np.array(self.dist_from, dtype=np.int32).reshape(-1, n)
+        self.dist_to = np.array(self.dist_to, dtype=np.int32).reshape(-1, n)
+        self.parent_from = np.array(self.parent_from, dtype=np.int64).reshape(-1, n)
+        self.next_to = np.array(self.next_to, dtype=np.int64).reshape(-1, n)
+
+    @staticmethod
+    def reverse(store):
+        """
+        Reverse adjacency, sorted by edge target, to walk edges backwards.
+
+        Returns:
+            (array(int), array(int), array(int)): reverse indptr and indices, and
+                the forward position of every reverse edge
+        """
+        n = len(store)
+        sources = np.repeat(np.arange(n), np.diff(store.indptr))
+        order = np.argsort(store.indices, kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(store.indices, minlength=n))
+        return indptr, sources[order], order
+
+    @staticmethod
+    def bfs(root, indptr, indices):
+        """
+        Breadth first search over CSR adjacency.
+
+        Returns:
+            (List(int), List(int)): hop count and parent of every node, -1 if unreachable
+        """
+        n = len(indptr) - 1
+        dist = [RoutingIndex.UNREACHABLE] * n
+        parent = [RoutingIndex.UNREACHABLE] * n
+        dist[root] = 0
+        que = deque([root])
+        while que:
+            u = que.popleft()
+            d = dist[u] + 1
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                if dist[v] == RoutingIndex.UNREACHABLE:
+                    dist[v] = d
+                    parent[v] = u
+                    que.append(v)
+        return dist, parent
+
+    def path(self, src, dst):
+        """
+        Shortest path between two nodes, same as nx.shortest_path without weights.
+
+        Args:
+            src int: osm id of start node
+            dst int: osm id of end node
+
+        Returns:
+            List(int): osm ids of nodes from src to dst inclusive
+        """
+        node_ids = self.store.node_ids
+        return [int(node_ids[i]) for i in self.path_index(self.store.index(src), self.store.index(dst))]
+
+    def path_index(self, si, di):
+        """
+        Same as path, over node positions in the graph store.
+        """
+        dst_row = self.rows.get(di)
+        if dst_row is not None and self.dist_to[dst_row, si] != RoutingIndex.UNREACHABLE:
+            # follow next hops towards fixed destination
+            self.hits += 1
+            nxt = self.next_to[dst_row]
+            steps = [si]
+            while steps[-1] != di:
+                steps.append(int(nxt[steps[-1]]))
+            return steps
+        src_row = self.rows.get(si)
+        if src_row is not None and self.dist_from[src_row, di] != RoutingIndex.UNREACHABLE:
+            # walk parents back from destination to fixed source
+            self.hits += 1
+            parent = self.parent_from[src_row]
+            steps = [di]
+            while steps[-1] != si:
+                steps.append(int(parent[steps[-1]]))
+            steps.reverse()
+            return steps
+        self.misses += 1
+        dist, parent = self.bfs(si, self.store.indptr, self.store.indices)
+        if dist[di] == RoutingIndex.UNREACHABLE:
+            raise NoPathError("no path from {} to {}".format(si, di))
+        steps = [di]
+        while steps[-1] != si:
+            steps.append(parent[steps[-1]])
+        steps.reverse()
+        return steps
+
+    def distance(self, src, dst):
+        """
+        Number of edges on the shortest path between two nodes.
+
+        Args:
+            src int: osm id of start node
+            dst int: osm id of end node
+
+        Returns:
+            int: hop count
+        """
+        return self.distance_index(self.store.index(src), self.store.index(dst))
+
+    def distance_index(self, si, di):
+        """
+        Same as distance, over node positions in the graph store.
+        """
+        dst_row = self.rows.get(di)
+        if dst_row is not None and self.dist_to[dst_row, si] != RoutingIndex.UNREACHABLE:
+            self.hits += 1
+            return int(self.dist_to[dst_row, si])
+        src_row = self.rows.get(si)
+        if src_row is not None and self.dist_from[src_row, di] != RoutingIndex.UNREACHABLE:
+            self.hits += 1
+            return int(self.dist_from[src_row, di])
+        return len(self.path_index(si, di)) - 1
+
+    def distances(self, src, targets):
+        """
+        Hop counts from one node to many, e.g. from a truck to every office.
+
+        Args:
+            src int: osm id of start node
+            targets List(int): osm ids of end nodes
+
+        Returns:
+            array(int): hop count to each target
+        """
+        return self.distances_index(self.store.index(src), [self.store.index(osmid) for osmid in targets])
+
+    def distances_index(self, si, targets):
+        """
+        Same as distances, over node positions in the graph store.
+        """
+        rows = [self.rows.get(di) for di in targets]
+        if None not in rows:
+            dist = self.dist_to[rows, si].astype(np.int64)
+            if not (dist == RoutingIndex.UNREACHABLE).any():
+                self.hits += len(targets)
+                return dist
+        return np.array([self.distance_index(si, di) for di in targets], dtype=np.int64)
+
+    def nearest(self, fixed_points):
+        """
+        Table of the fixed point closest to every node, by distance from the
+        node to the fixed point.
+
+        Args:
+            fixed_points List(int): osm ids, each a fixed point of the index
+
+        Returns:
+            array(int): position in fixed_points for every node, 0 where none can be reached
+        """
+        dist = self.dist_to[[self.fixed[osmid] for osmid in fixed_points]].astype(np.float64)
+        dist[dist == RoutingIndex.UNREACHABLE] = np.inf
+        return np.argmin(dist, axis=0)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class LandmarkRouter:
+    LANDMARKS = 16  # landmarks giving lower bounds for A*
+    ACTIVE = 4  # landmarks used by a query, the ones with the best bound between its end points
+    WEIGHTS = ('length', 'time')
+    TABLES = ('landmarks', 'lm_from', 'lm_to', 'dist_from', 'parent_from', 'dist_to', 'next_to')
+    META = 'meta.json'
+
+    def __init__(self, store, fixed_points, weight='length', landmarks=LANDMARKS, tables=None):
+        """
+        Shortest paths by edge length or by driving time. As in RoutingIndex,
+        one shortest path tree per fixed point in each direction turns every
+        query from or to the metro or an office into a lookup. Other queries
+        run A* with lower bounds from distances to and from a few landmarks
+        spread over the map (ALT). The preprocessed tables can be written with
+        save and memory-mapped back with load.
+
+        Args:
+            store GraphStore: road network arrays
+            fixed_points List(int): osm ids of metro and office nodes
+            weight str: 'length' for meters or 'time' for seconds of driving
+            landmarks int: number of landmarks to select
+            tables dict: preprocessed arrays as written by save, computed if None
+        """
+        if weight not in LandmarkRouter.WEIGHTS:
+            raise ValueError("weight must be one of {}".format(", ".join(LandmarkRouter.WEIGHTS)))
+        self.store = store
+        self.weight = weight
+        self.hits = 0
+        self.misses = 0
+        weights = store.lengths if weight == 'length' else store.travel_times()
+        self.weights = np.asarray(weights, dtype=np.float64)
+        rev_indptr, rev_indices, order = RoutingIndex.reverse(store)
+        self.forward = (store.indptr.tolist(), store.indices.tolist(), self.weights.tolist())
+        self.backward = (rev_indptr.tolist(), rev_indices.tolist(), self.weights[order].tolist())
+        self.fixed = {}  # osm id -> row in tables
+        for osmid in fixed_points:
+            self.fixed.setdefault(osmid, len(self.fixed))
+        self.rows = {store.index(osmid): row for osmid, row in self.fixed.items()}  # node position -> row
+        if tables is None:
+            tables = self.preprocess(landmarks)
+        for name in LandmarkRouter.TABLES:
+            setattr(self, name, tables[name])
+
+    @staticmethod
+    def dijkstra(root, indptr, indices, weights, targets=None):
+        """
+        Dijkstra search over CSR adjacency, stopping early once all targets are settled.
+
+        Returns:
+            (List(float), List(int)): distance and parent of every node, inf and -1 if unreachable
+        """
+        n = len(indptr) - 1
+        dist = [np.inf] * n
+        parent = [RoutingIndex.UNREACHABLE] * n
+        dist[root] = 0.
+        heap = [(0., root)]
+        left = set(targets) if targets else None
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if left is not None:
+                left.discard(u)
+                if not left:
+                    break
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                nd = d + weights[k]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    parent[v] = u
+                    heapq.heappush(heap, (nd, v))
+        return dist, parent
+
+    def preprocess(self, count):
+        """
+        Trees of the fixed points, and landmarks chosen by farthest point
+        selection: each new landmark is the node farthest from all previous ones.
+
+        Returns:
+            dict: arrays named as in TABLES
+        """
+        n = len(self.store)
+        trees = {'dist_from': [], 'parent_from': [], 'dist_to': [], 'next_to': []}
+        for osmid in self.fixed:
+            root = self.store.index(osmid)
+            dist, parent = self.dijkstra(root, *self.forward)
+            trees['dist_from'].append(dist)
+            trees['parent_from'].append(parent)
+            dist, parent = self.dijkstra(root, *self.backward)
+            trees['dist_to'].append(dist)
+            trees['next_to'].append(parent)
+        tables = {name: np.array(rows, dtype=np.int64 if name.startswith(('parent', 'next')) else np.float64)
+                  .reshape(-1, n) for name, rows in trees.items()}
+
+        start = self.store.index(next(iter(self.fixed))) if self.fixed else 0
+        closest = np.asarray(self.dijkstra(start, *self.forward)[0])
+        landmarks, lm_from, lm_to = [], [], []
+        for _ in range(min(count, n)):
+            reachable = np.where(np.isfinite(closest), closest, -1)
+            landmark = int(np.argmax(reachable))
+            if landmarks and reachable[landmark] <= 0:
+                break
+            landmarks.append(landmark)
+            lm_from.append(self.dijkstra(landmark, *self.forward)[0])
+            lm_to.append(self.dijkstra(landmark, *self.backward)[0])
+            nearest = np.minimum(lm_from[-1], lm_to[-1])
+            closest = np.minimum(closest, nearest) if len(landmarks) > 1 else nearest
+        tables['landmarks'] = np.array(landmarks, dtype=np.int64)
+        tables['lm_from'] = np.array(lm_from, dtype=np.float64).reshape(-1, n)
+        tables['lm_to'] = np.array(lm_to, dtype=np.float64).reshape(-1, n)
+        return tables
+
+    def lower_bound(self, si, di):
+        """
+        Lower bound on the distance from a node to di, from the ACTIVE
+        landmarks that bound the distance from si to di best. By the triangle
+        inequality d(v, t) >= d(l, t) - d(l, v) and d(v, t) >= d(v, l) - d(t, l).
+        Only the landmarks are ranked up front, a node is bounded when A*
+        first reaches it.
+
+        Returns:
+            function: bound of a node position, inf if it cannot reach di
+        """
+        if not len(self.landmarks):
+            return lambda v: 0.
+        with np.errstate(invalid='ignore'):
+            bound = np.fmax(self.lm_from[:, di] - self.lm_from[:, si], self.lm_to[:, si] - self.lm_to[:, di])
+        active = np.argsort(-np.nan_to_num(bound, nan=-np.inf))[:LandmarkRouter.ACTIVE]
+        rows = [(self.lm_from[i], float(self.lm_from[i, di]), self.lm_to[i], float(self.lm_to[i, di]))
+                for i in active]
+        bounds = {}
+
+        def node_bound(v):
+            b = bounds.get(v)
+            if b is None:
+                b = 0.
+                for lm_from, from_di, lm_to, to_di in rows:
+                    # comparisons with nan are false, so terms of landmarks reaching neither node are skipped
+                    d = from_di - float(lm_from[v])
+                    if d > b:
+                        b = d
+                    d = float(lm_to[v]) - to_di
+                    if d > b:
+                        b = d
+                bounds[v] = b
+            return b
+        return node_bound
+
+    def astar(self, si, di):
+        """
+        A* search between two node positions guided by landmark bounds.
+
+        Returns:
+            (float, List(int)): distance and node positions from si to di inclusive
+        """
+        bound = self.lower_bound(si, di)
+        indptr, indices, weights = self.forward
+        dist = {si: 0.}
+        parent = {si: RoutingIndex.UNREACHABLE}
+        heap = [(bound(si), si)]
+        closed = set()
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u == di:
+                break
+            if u in closed:
+                continue
+            closed.add(u)
+            du = dist[u]
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                d = du + weights[k]
+                if d < dist.get(v, np.inf):
+                    b = bound(v)
+                    if b < np.inf:
+                        dist[v] = d
+                        parent[v] = u
+                        heapq.heappush(heap, (d + b, v))
+        if di not in dist:
+            raise NoPathError("no path from {} to {}".format(si, di))
+        steps = [di]
+        while steps[-1] != si:
+            steps.append(parent[steps[-1]])
+        steps.reverse()
+        return dist[di], steps
+
+    def path(self, src, dst):
+        """
+        Shortest path between two nodes by the router weight.
+
+        Args:
+            src int: osm id of start node
+            dst int: osm id of end node
+
+        Returns:
+            List(int): osm ids of nodes from src to dst inclusive
+        """
+        node_ids = self.store.node_ids
+        return [int(node_ids[i]) for i in self.path_index(self.store.index(src), self.store.index(dst))]
+
+    def path_index(self, si, di):
+        """
+        Same as path, over node positions in the graph store.
+        """
+        dst_row = self.rows.get(di)
+        if dst_row is not None and np.isfinite(self.dist_to[dst_row, si]):
+            self.hits += 1
+            nxt = self.next_to[dst_row]
+            steps = [si]
+            while steps[-1] != di:
+                steps.append(int(nxt[steps[-1]]))
+            return steps
+        src_row = self.rows.get(si)
+        if src_row is not None and np.isfinite(self.dist_from[src_row, di]):
+            self.hits += 1
+            parent = self.parent_from[src_row]
+            steps = [di]
+            while steps[-1] != si:
+                steps.append(int(parent[steps[-1]]))
+            steps.reverse()
+            return steps
+        self.misses += 1
+        return self.astar(si, di)[1]
+
+    def distance(self, src, dst):
+        """
+        Length in meters or driving time in seconds of the shortest path.
+
+        Args:
+            src int: osm id of start node
+            dst int: osm id of end node
+
+        Returns:
+            float: distance by the router weight
+        """
+        return self.distance_index(self.store.index(src), self.store.index(dst))
+
+    def distance_index(self, si, di):
+        """
+        Same as distance, over node positions in the graph store.
+        """
+        dst_row = self.rows.get(di)
+        if dst_row is not None and np.isfinite(self.dist_to[dst_row, si]):
+            self.hits += 1
+            return float(self.dist_to[dst_row, si])
+        src_row = self.rows.get(si)
+        if src_row is not None and np.isfinite(self.dist_from[src_row, di]):
+            self.hits += 1
+            return float(self.dist_from[src_row, di])
+        self.misses += 1
+        return self.astar(si, di)[0]
+
+    def distances(self, src, targets):
+        """
+        Distances from one node to many, e.g. from a truck to every office.
+        Fixed targets are read from their trees, the others are found by a
+        single Dijkstra search that stops once all of them are settled.
+
+        Args:
+            src int: osm id of start node
+            targets List(int): osm ids of end nodes
+
+        Returns:
+            array(float): distance to each target, inf if unreachable
+        """
+        return self.distances_index(self.store.index(src), [self.store.index(osmid) for osmid in targets])
+
+    def distances_index(self, si, targets):
+        """
+        Same as distances, over node positions in the graph store.
+        """
+        result = np.full(len(targets), np.inf)
+        rest = {}  # node position -> positions in targets
+        for k, di in enumerate(targets):
+            row = self.rows.get(di)
+            if row is not None:
+                result[k] = self.dist_to[row, si]
+            else:
+                rest.setdefault(di, []).append(k)
+        self.hits += len(targets) - sum(len(ks) for ks in rest.values())
+        if rest:
+            self.misses += 1
+            dist, _ = self.dijkstra(si, *self.forward, targets=rest)
+            for di, ks in rest.items():
+                result[ks] = dist[di]
+        return result
+
+    def nearest(self, fixed_points):
+        """
+        Table of the fixed point closest to every node, see RoutingIndex.nearest.
+        """
+        return np.argmin(self.dist_to[[self.fixed[osmid] for osmid in fixed_points]], axis=0)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def save(self, path):
+        """
+        Write the preprocessed tables to a directory, written aside and renamed
+        into place like GraphStore.save.
+
+        Args:
+            path str: index directory
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        for name in LandmarkRouter.TABLES:
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(tmp, LandmarkRouter.META), 'w') as f:
+            json.dump({'weight': self.weight, 'fixed': list(self.fixed), 'nodes': len(self.store)}, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp)
+
+    @classmethod
+    def load(cls, store, path):
+        """
+        Memory-map tables written by save.
+
+        Args:
+            store GraphStore: road network the tables were built on
+            path str: index directory
+
+        Returns:
+            LandmarkRouter
+        """
+        with open(os.path.join(path, cls.META)) as f:
+            meta = json.load(f)
+        if meta['nodes'] != len(store):
+            raise ValueError("routing index at {} was built for another graph".format(path))
+        tables = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in cls.TABLES}
+        return cls(store, meta['fixed'], weight=meta['weight'], tables=tables)
+
+    @classmethod
+    def cached(cls, store, fixed_points, weight='length', landmarks=LANDMARKS):
+        """
+        Router for a saved store, preprocessed once and cached next to the
+        store arrays.
+
+        Returns:
+            LandmarkRouter
+        """
+        if store.path is None:
+            return cls(store, fixed_points, weight, landmarks)
+        key = store.cache_key('routing', weight, landmarks, tuple(fixed_points))
+        path = os.path.join(store.path, 'routing_{}'.format(key))
+        if os.path.exists(os.path.join(path, cls.META)):
+            return cls.load(store, path)
+        router = cls(store, fixed_points, weight, landmarks)
+        router.save(path)
+        return router
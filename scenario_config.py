@@ -0,0 +1,135 @@
+import itertools as itr
+import json
+
+from demand import DemandProfile
+from graph_store import GraphStore
+from simulation_engine import SimulationEngine
+from sweep import PARAMETERS
+
+KEYS = ('graph', 'metro', 'offices', 'constants', 'demand', 'strategy', 'seed', 'routing', 'engine', 'turns')
+ENGINES = ('turn', 'event')
+
+
+class ScenarioConfig:
+    STRATEGY = 'aging'
+    TURNS = 100
+    SEED = 25  # seed when neither the scenario nor the caller gives one, so every run is reproducible
+
+    def __init__(self, config):
+        """
+        A scenario described by plain values, as read from a json file:
+
+            graph      where the road network comes from, one of
+                       {"file": <.graphml or .osm extract>}, {"store": <saved GraphStore directory>},
+                       {"center": [lat, lon], "distance": <meters>} or
+                       {"synthetic": "grid" or "geometric", "nodes": <int>, "seed": <int>},
+                       the default network of SimulationEngine if missing
+            metro      osm id of the metro, or list of osm ids of all transit hubs with the metro first
+            offices    list of osm ids of offices
+            constants  fleet sizes and rates by class constant name, e.g. SCOOTERS_TOTAL, NUMBER, IN_RATE,
+                       any name of sweep.PARAMETERS
+            demand     keyword arguments of DemandProfile, curve can also name one of its curves, e.g. MORNING_PEAK
+            strategy   scoring for trucks, see SimulationEngine
+            seed       seed of all random draws
+            routing    see SimulationEngine
+            engine     'turn' for SimulationEngine or 'event' for EventSimulation, which cannot be rendered
+            turns      number of turns to run
+
+        Only the keys present override the defaults of the simulation.
+
+        Args:
+            config dict: scenario values
+        """
+        unknown = set(config) - set(KEYS)
+        if unknown:
+            raise ValueError("unknown scenario keys {}".format(", ".join(sorted(unknown))))
+        unknown = set(config.get('constants', {})) - set(PARAMETERS)
+        if unknown:
+            raise ValueError("unknown constants {}".format(", ".join(sorted(unknown))))
+        if config.get('engine', 'turn') not in ENGINES:
+            raise ValueError("engine must be one of {}".format(", ".join(ENGINES)))
+        self.config = config
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    @property
+    def strategy(self):
+        return self.config.get('strategy', ScenarioConfig.STRATEGY)
+
+    @property
+    def seed(self):
+        return self.config.get('seed', ScenarioConfig.SEED)
+
+    @property
+    def turns(self):
+        return self.config.get('turns', ScenarioConfig.TURNS)
+
+    def load_store(self):
+        """
+        Road network of the scenario. Only downloads and file extracts need
+        osmnx, and only when they are not cached yet.
+
+        Returns:
+            GraphStore
+        """
+        graph = self.config.get('graph', {})
+        if 'store' in graph:
+            return GraphStore.load(graph['store'])
+        if 'file' in graph:
+            return GraphStore.from_file(graph['file'], graph.get('network_type', 'drive'))
+        if 'synthetic' in graph:
+            from benchmark import synthetic_city
+            return GraphStore.from_graph(synthetic_city(graph['synthetic'], graph.get('nodes', 2500),
+                                                        graph.get('seed', 0)))
+        return GraphStore.from_point(graph.get('center', SimulationEngine.CENTER),
+                                     graph.get('distance', SimulationEngine.DISTANCE),
+                                     graph.get('network_type', 'drive'))
+
+    def apply(self, constants=None):
+        """
+        Set the class constants of the scenario.
+
+        Args:
+            constants dict: values by name of sweep.PARAMETERS set over the ones of the scenario
+        """
+        for name, value in itr.chain(self.config.get('constants', {}).items(), (constants or {}).items()):
+            setattr(PARAMETERS[name], name, value)
+
+    def demand(self):
+        """
+        Returns:
+            DemandProfile: demand of the scenario, None for the default of the engine
+        """
+        if 'demand' not in self.config:
+            return None
+        kwargs = dict(self.config['demand'])
+        if isinstance(kwargs.get('curve'), str):
+            kwargs['curve'] = getattr(DemandProfile, kwargs['curve'])
+        return DemandProfile(**kwargs)
+
+    def engine(self, store=None, score_func=None, seed=None, constants=None):
+        """
+        Set the class constants and build the engine of the scenario.
+
+        Args:
+            store GraphStore: road network, loaded with load_store if None
+            score_func str: scoring for trucks, the one of the scenario if None
+            seed int: seed of all random draws, the one of the scenario if None
+            constants dict: class constants set over the ones of the scenario, see apply
+
+        Returns:
+            SimulationEngine: or EventSimulation
+        """
+        self.apply(constants)
+        store = self.load_store() if store is None else store
+        if self.config.get('engine', 'turn') == 'event':
+            from event_simulation import EventSimulation as engine_class
+        else:
+            engine_class = SimulationEngine
+        return engine_class(store, self.config.get('metro'), self.config.get('offices'),
+                            score_func=self.strategy if score_func is None else score_func,
+                            seed=self.seed if seed is None else seed,
+                            routing=self.config.get('routing', 'hops'), demand=self.demand())
@@ -1,70 +1,312 @@
 from collections import deque
-from random import randint, random
+from random import getrandbits
 
-import networkx as nx
+import numpy as np
+
+from demand import DemandProfile
+from graph_store import GraphStore
+from routing import RoutingIndex
 
 
 class SimulateScooters:
-    IN_RATE = 30  # customers exiting metro per turn
-    OFFICE_NUM = 10  # number of offices
-    OFFICE_PROB = 1 / OFFICE_NUM  # equal probability of going to any office
+    IN_RATE = 30  # customers exiting metro per turn, unless a demand profile is given
+    OFFICE_NUM = 10  # number of offices of the default scenario, arrays follow the offices passed in
+    OFFICE_PROB = 1 / OFFICE_NUM  # equal probability of going to any office, unless weighted by the demand profile
     WAITING_TIME = 3  # maximum turns customer will wait for scooter
     SCOOTERS_TOTAL = 200  # scooters in simulation
     REPLENISH = 0.005  # scooters come back to metro due random commute
     SIZE = 15  # size of scooter on graph
 
-    def __init__(self, G, office_nodes, metro_node):
+    # scooter states
+    AT_METRO = 0
+    RIDING = 1
+    AT_OFFICE = 2
+    ON_TRUCK = 3
+
+    def __init__(self, G, office_nodes, metro_node, router=None, rng=None, demand=None, hub_nodes=None):
         """
-        Initialize scooters, offices and metro positions for simulation
+        Initialize scooters, offices and metro positions for simulation. The
+        fleet is held as arrays indexed by scooter, positions are node
+        positions in the graph store. Waiting customers are kept as cohorts of
+        [expiry turn, count] in arrival order. Parked scooters are kept on a
+        stack per hub and per office, scooters on trucks on one more, so
+        scooters are found without scanning the fleet.
+
+        With several transit hubs customers exit every hub and wait in a queue
+        of their own for scooters parked there. Scooters are spread evenly
+        over the hubs at the start, and a scooter returning by itself goes to
+        the hub closest to its office.
 
         Args:
-            G <graph object>: map of city
+            G <graph object>: map of city, only used to build a router if none is given
             office_nodes List[nodes]: List of office node positions
             metro_node node: metro node position
+            router RoutingIndex: shortest paths to and from metro and offices
+            rng <numpy Generator>: source of random draws, seeded from the random module if None
+            demand DemandProfile: customer arrivals and destinations, IN_RATE customers per turn
+                going to any office with equal probability if None
+            hub_nodes List[nodes]: all transit hubs, metro_node first, only the metro if None
         """
         self.map = G
-        self.que = deque()  # que of waiting customers
+        self.hubs = [metro_node] if hub_nodes is None else list(hub_nodes)
+        hub_ids = [hub['osmid'] for hub in self.hubs]
+        if router is None:
+            router = RoutingIndex(GraphStore.from_graph(G), hub_ids + [office['osmid'] for office in office_nodes])
+        self.router = router
+        self.store = router.store
+        self.rng = rng if rng is not None else np.random.default_rng(getrandbits(64))
+        self.demand = demand if demand is not None else DemandProfile(SimulateScooters.IN_RATE)
+        self.ques = [deque() for _ in self.hubs]  # [expiry turn, customers] of waiting customers at each hub
+        self.que = self.ques[0]  # waiting customers at metro
         self.customers_served = 0
         self.customers_dropped = 0
         self.total_waiting_time = 0
-        self.scooters = [metro_node] * SimulateScooters.SCOOTERS_TOTAL  # scooters moving to destination
-        self.scooters_ride = [None] * SimulateScooters.SCOOTERS_TOTAL  # scooter destination
         self.offices = office_nodes  # office location with parked scooters
         self.metro = metro_node  # metro location with parked scooters
-        self.scooters_metro = SimulateScooters.SCOOTERS_TOTAL
-        self.scooters_office = [0] * SimulateScooters.OFFICE_NUM
-        self.office_paths = [deque(nx.shortest_path(self.map, self.metro['osmid'], office['osmid'])) for office in
-                             self.offices]
+        self.metro_idx = self.store.index(metro_node['osmid'])
+        self.hub_idx = np.array([self.store.index(osmid) for osmid in hub_ids], dtype=np.int64)
+        self.office_idx = np.array([self.store.index(office['osmid']) for office in office_nodes], dtype=np.int64)
+        total = SimulateScooters.SCOOTERS_TOTAL
+        hubs = len(self.hubs)
+        self.scooters_hub = np.diff(np.arange(hubs + 1) * total // hubs)  # scooters parked at each hub
+        self.scooters_office = np.zeros(len(office_nodes), dtype=np.int64)
+        self.office_hub = self.router.nearest(hub_ids)[self.office_idx]  # hub scooters at each office return to
+
+        # ride paths from each hub to each office, padded with the office position
+        paths = [[self.router.path_index(hub, office) for office in self.office_idx] for hub in self.hub_idx]
+        self.hub_path_len = np.array([[len(path) for path in row] for row in paths], dtype=np.int64)
+        self.hub_path_nodes = np.empty(self.hub_path_len.shape + (self.hub_path_len.max(),), dtype=np.int64)
+        for h, row in enumerate(paths):
+            for i, path in enumerate(row):
+                self.hub_path_nodes[h, i, :len(path)] = path
+                self.hub_path_nodes[h, i, len(path):] = path[-1]
+        self.path_len = self.hub_path_len[0]  # rides from metro
+        self.path_nodes = self.hub_path_nodes[0]
+
+        # fleet state
+        self.location = np.repeat(self.hub_idx, self.scooters_hub)  # node position of scooter
+        self.ride = np.full(total, -1, dtype=np.int64)  # office of current or last ride
+        self.origin = np.zeros(total, dtype=np.int64)  # hub of current or last ride
+        self.cursor = np.zeros(total, dtype=np.int64)  # step along ride path
+        self.state = np.full(total, SimulateScooters.AT_METRO, dtype=np.int8)
+        # stacks of parked scooters, one per hub, then one per office, then one for all trucks
+        self.office_place = hubs  # stack of the first office
+        self.truck_place = hubs + len(office_nodes)  # stack of scooters on trucks
+        self.parked = [np.empty(0, dtype=np.int64) for _ in range(self.truck_place + 1)]
+        self.parked_size = np.zeros(self.truck_place + 1, dtype=np.int64)
+        first = np.concatenate(([0], np.cumsum(self.scooters_hub)))
+        for hub in range(hubs):
+            self.park(hub, np.arange(first[hub], first[hub + 1], dtype=np.int64))
         self.fixed_point = 40
         self.under_utilization = 0
 
+    @property
+    def scooters_metro(self):
+        """
+        Scooters parked at the metro, the first hub.
+        """
+        return int(self.scooters_hub[0])
+
+    @scooters_metro.setter
+    def scooters_metro(self, count):
+        self.scooters_hub[0] = count
+
+    def get_state(self):
+        """
+        Everything about the scooters that changes while simulating.
+
+        Returns:
+            dict: arrays and plain values, see Snapshot
+        """
+        return {
+            'que': np.array([[hub, expiry, count] for hub, que in enumerate(self.ques) for expiry, count in que],
+                            dtype=np.int64).reshape(-1, 3),
+            'customers_served': int(self.customers_served),
+            'customers_dropped': int(self.customers_dropped),
+            'total_waiting_time': int(self.total_waiting_time),
+            'scooters_hub': self.scooters_hub,
+            'scooters_office': np.asarray(self.scooters_office, dtype=np.int64),
+            'location': self.location,
+            'ride': self.ride,
+            'origin': self.origin,
+            'cursor': self.cursor,
+            'state': self.state,
+            'parked': np.concatenate([stack[:size] for stack, size in zip(self.parked, self.parked_size)]),
+            'parked_size': self.parked_size,
+            'under_utilization': int(self.under_utilization),
+            'rng': self.rng.bit_generator.state,
+        }
+
+    def set_state(self, state):
+        """
+        Continue from a state returned by get_state, arrays are taken over
+        without copying.
+        """
+        if len(state['location']) != len(self.location):
+            raise ValueError("state has {} scooters, expected {}".format(len(state['location']), len(self.location)))
+        self.ques = [deque() for _ in self.hubs]
+        for hub, expiry, count in state['que'].tolist():
+            self.ques[hub].append([expiry, count])
+        self.que = self.ques[0]
+        self.customers_served = state['customers_served']
+        self.customers_dropped = state['customers_dropped']
+        self.total_waiting_time = state['total_waiting_time']
+        self.scooters_hub = state['scooters_hub']
+        self.scooters_office = state['scooters_office']
+        self.location = state['location']
+        self.ride = state['ride']
+        self.origin = state['origin']
+        self.cursor = state['cursor']
+        self.state = state['state']
+        self.parked_size = state['parked_size']
+        self.parked = np.split(state['parked'], np.cumsum(self.parked_size)[:-1])
+        self.under_utilization = state['under_utilization']
+        bit_generator = getattr(np.random, state['rng']['bit_generator'])()
+        bit_generator.state = state['rng']
+        self.rng = np.random.Generator(bit_generator)
+
     def node_positions(self):
         """
-        Make two separate list of positions for all points of interest
+        Make two separate arrays of positions for all points of interest
 
         Return:
-            (List(int), List(int)) - List of x and y coordinates
+            (array(float), array(float)) - x and y coordinates
         """
-        x = [self.metro['x']] + [office['x'] for office in self.offices] + [scooter['x'] for scooter in self.scooters]
-        y = [self.metro['y']] + [office['y'] for office in self.offices] + [scooter['y'] for scooter in self.scooters]
-        return x, y
+        points = np.concatenate((self.hub_idx, self.office_idx, self.location))
+        return self.store.x[points], self.store.y[points]
+
+    def node_counts(self):
+        """
+        Scooters at every point of interest, from the counts of hubs and
+        offices, which trucks keep up to date, and one per ridden scooter.
+
+        Return:
+            (array(int), array(int)) - node positions and number of scooters at each
+        """
+        riding = np.flatnonzero(self.state == SimulateScooters.RIDING)
+        return (np.concatenate((self.hub_idx, self.office_idx, self.location[riding])),
+                np.concatenate((self.scooters_hub, self.scooters_office, np.ones(len(riding), dtype=np.int64))))
 
     def node_size(self):
         """
-        Make array of number of scooters parked at metro and offices. All scooters being ridden
+        Make array of number of scooters parked at hubs and offices. All scooters being ridden
         have display a single fixed size point.
 
         Return:
-            List(int): indicating size of point
+            array(int): indicating size of point
+        """
+        scooters = np.where(self.state == SimulateScooters.RIDING, SimulateScooters.SIZE, 0)
+        mapped_scooters_office = self.scooters_office * self.scooters_office + self.fixed_point
+        return np.concatenate((self.scooters_hub * self.scooters_hub + self.fixed_point, mapped_scooters_office,
+                               scooters))
+
+    def serve(self, turn, hub=0):
+        """
+        Drop the customers whose waiting time ran out and serve the others in
+        arrival order with scooters parked at their hub. Work is per cohort,
+        not per customer.
+
+        Args:
+            turn int: current turn number
+            hub int: hub the customers wait at, the metro by default
+
+        Returns:
+            int: customers served
+        """
+        que = self.ques[hub]
+        if que and que[0][0] == turn:
+            # remove waiting customers
+            self.customers_dropped += que.popleft()[1]
+        served = 0
+        parked = int(self.scooters_hub[hub])
+        while que and parked:
+            cohort = que[0]
+            take = min(cohort[1], parked)
+            cohort[1] -= take
+            parked -= take
+            self.customers_served += take
+            self.total_waiting_time += take * (SimulateScooters.WAITING_TIME + turn - cohort[0])
+            served += take
+            if not cohort[1]:
+                que.popleft()
+        self.scooters_hub[hub] = parked
+        return served
+
+    def arrive(self, turn):
+        """
+        Add the customers exiting the metro, or each hub, in the turn as a new cohort.
+        """
+        customers = self.demand.arrivals(turn, self.rng)
+        if not customers:
+            return
+        if len(self.ques) == 1:
+            self.que.append([turn + SimulateScooters.WAITING_TIME, customers])
+            return
+        for que, count in zip(self.ques, self.demand.origins(customers, len(self.ques), self.rng).tolist()):
+            if count:
+                que.append([turn + SimulateScooters.WAITING_TIME, count])
+
+    def park(self, place, ids):
+        """
+        Put scooters on the stack of a hub, office or the trucks, the first
+        one on top. Stacks grow by doubling.
+
+        Args:
+            place int: stack, see __init__
+            ids array(int): ids of scooters
+        """
+        stack = self.parked[place]
+        size = self.parked_size[place]
+        if size + len(ids) > len(stack):
+            grown = np.empty(max(2 * len(stack), size + len(ids)), dtype=np.int64)
+            grown[:size] = stack[:size]
+            self.parked[place] = stack = grown
+        stack[size:size + len(ids)] = ids[::-1]
+        self.parked_size[place] = size + len(ids)
+
+    def unpark(self, place, count):
+        """
+        Take scooters off the top of the stack of a hub, office or the trucks.
+
+        Returns:
+            array(int): ids of scooters, top first
+        """
+        top = self.parked_size[place]
+        self.parked_size[place] = max(top - count, 0)
+        return self.parked[place][self.parked_size[place]:top][::-1]
+
+    def take_free(self, count, hub=0):
         """
-        scooters = []
-        for ride in self.scooters_ride:
-            if ride:
-                scooters.append(SimulateScooters.SIZE)
-            else:
-                scooters.append(0)
-        mapped_scooters_office = [n * n + self.fixed_point for n in self.scooters_office]
-        return [self.scooters_metro * self.scooters_metro + self.fixed_point] + mapped_scooters_office + scooters
+        Pick scooters parked at a hub for new rides.
+
+        Returns:
+            array(int): ids of scooters
+        """
+        return self.unpark(hub, count)
+
+    def return_to_hub(self, ids, hub):
+        """
+        Park scooters at a hub, e.g. brought back by a truck.
+        """
+        self.location[ids] = self.hub_idx[hub]
+        self.ride[ids] = -1
+        self.state[ids] = SimulateScooters.AT_METRO
+        self.park(hub, ids)
+
+    def move_by_trucks(self):
+        """
+        Move scooters between stacks after trucks changed the counts of hubs
+        and offices: scooters picked up at offices go onto the trucks, the
+        ones delivered to hubs come off them.
+        """
+        picked = self.parked_size[self.office_place:self.truck_place] - self.scooters_office
+        for office in np.flatnonzero(picked > 0).tolist():
+            ids = self.unpark(self.office_place + office, picked[office])
+            self.state[ids] = SimulateScooters.ON_TRUCK
+            self.park(self.truck_place, ids)
+        delivered = self.scooters_hub - self.parked_size[:self.office_place]
+        for hub in np.flatnonzero(delivered > 0).tolist():
+            self.return_to_hub(self.unpark(self.truck_place, delivered[hub]), hub)
 
     def turn(self, turn):
         """
@@ -73,59 +315,42 @@ class SimulateScooters:
         Args:
             turn int: current turn number
         """
-        # small probability to replenish scooters
-        for i, pos in enumerate(self.scooters):
-            for j, office in enumerate(self.offices):
-                if pos == office and random() < SimulateScooters.REPLENISH:
-                    self.scooters_office[j] -= 1
-                    self.scooters[i] = self.metro
-                    self.scooters_ride[i] = None
-                    self.scooters_metro += 1
+        # small probability to replenish scooters, drawn per office as scooters parked there are alike
+        back = self.rng.binomial(self.scooters_office, SimulateScooters.REPLENISH)
+        for office in np.flatnonzero(back).tolist():
+            hub = self.office_hub[office]
+            self.return_to_hub(self.unpark(self.office_place + office, back[office]), hub)
+            self.scooters_office[office] -= back[office]
+            self.scooters_hub[hub] += back[office]
 
         # update currently ridden scooters
-        for i, ride in enumerate(self.scooters_ride):
-            if not ride:
-                continue
-            next_pos = ride.popleft()
-            if not ride:
-                # ride completed at office location
-                for j, office in enumerate(self.offices):
-                    if office['osmid'] == next_pos:
-                        self.scooters_office[j] += 1
-                        self.scooters_ride[j] = None
-
-            self.scooters[i] = self.map.node.get(next_pos)
-
-        # handle customers waiting at metro
-        while self.que:
-            if self.que[0] == turn:
-                # remove waiting customers
-                self.que.popleft()
-                self.customers_dropped += 1
-            else:
-                if self.scooters_metro:
-                    # schedule new scooters and
-                    office_id = randint(0, SimulateScooters.OFFICE_NUM - 1)
-                    for j, ride in enumerate(self.scooters_ride):
-                        if not ride:
-                            self.scooters_ride[j] = deque(self.office_paths[office_id])
-                            self.scooters_ride[j].popleft()
-                            break
-                    drop_turn = self.que.popleft()
-                    self.scooters_metro -= 1
-                    self.customers_served += 1
-                    self.total_waiting_time += SimulateScooters.WAITING_TIME + turn - drop_turn
-                else:
-                    break
-
-        # add new customers
-        for i in range(SimulateScooters.IN_RATE):
-            self.que.append(turn + SimulateScooters.WAITING_TIME)
+        riding = np.flatnonzero(self.state == SimulateScooters.RIDING)
+        self.cursor[riding] += 1
+        self.location[riding] = self.hub_path_nodes[self.origin[riding], self.ride[riding], self.cursor[riding]]
+        # ride completed at office location
+        arrived = riding[self.cursor[riding] >= self.hub_path_len[self.origin[riding], self.ride[riding]] - 1]
+        self.state[arrived] = SimulateScooters.AT_OFFICE
+        arrived = arrived[np.argsort(self.ride[arrived], kind='stable')]
+        offices, first = np.unique(self.ride[arrived], return_index=True)
+        for office, ids in zip(offices.tolist(), np.split(arrived, first[1:])):
+            self.park(self.office_place + office, ids)
+        self.scooters_office += np.bincount(self.ride[arrived], minlength=len(self.office_idx))
+
+        # handle customers waiting at each hub and schedule new rides
+        for hub in range(len(self.hubs)):
+            served = self.serve(turn, hub)
+            if served:
+                free = self.take_free(served, hub)
+                self.ride[free] = self.demand.destinations(len(free), len(self.office_idx), self.rng)
+                self.origin[free] = hub
+                self.cursor[free] = 0
+                self.location[free] = self.hub_idx[hub]
+                self.state[free] = SimulateScooters.RIDING
+
+        self.arrive(turn)
 
         # add under utilization to scooters that are not moving
-        for ride in self.scooters_ride:
-            if not ride:
-                self.under_utilization += 1
+        self.under_utilization += int(np.count_nonzero(self.state != SimulateScooters.RIDING))
 
         # log metrics for each turn
         metrics = []
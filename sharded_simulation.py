@@ -0,0 +1,305 @@
+import contextlib
+from collections import deque
+from multiprocessing import Pipe, Process
+
+import numpy as np
+
+from demand import DemandProfile
+from graph_store import GraphStore
+from scooter_simulation import SimulateScooters
+from simulation_engine import SimulationEngine, TurnMetrics
+from sweep import PARAMETERS
+from truck_simulation import SimulateTrucks
+
+
+def _shard_worker(conn, store_path, metro, offices, starts, score_func, seed, routing, constants):
+    """
+    Entry point of a shard process, answers one message per turn until it receives None.
+    """
+    for name, value in constants.items():
+        setattr(PARAMETERS[name], name, value)
+    shard = Shard(GraphStore.load(store_path), metro, offices, starts, score_func, seed, routing)
+    for message in iter(conn.recv, None):
+        conn.send(shard.step(*message))
+    conn.close()
+
+
+class Shard:
+
+    def __init__(self, store, metro, offices, starts, score_func, seed, routing):
+        """
+        The offices of one region with their parked scooters, scooters riding
+        to them and the trucks serving them. Scooters only enter and leave a
+        region through the metro, rides come in and returns and deliveries go
+        out in the per turn messages. Sets the class constants for its own
+        process, so it has to run in a process of its own.
+
+        Args:
+            store GraphStore: road network arrays
+            metro int: osm id of metro node
+            offices List(int): osm ids of the offices of the region
+            starts List(int): node positions trucks start at, one per truck
+            score_func str: scoring for trucks, see SimulationEngine
+            seed int: seed of the random draws of the region
+            routing str: see SimulationEngine
+        """
+        SimulateScooters.SCOOTERS_TOTAL = 0  # scooters are only counted per office here
+        SimulateTrucks.NUMBER = len(starts)
+        # the engine provides routing, truck planning and ride lengths for the region
+        self.engine = SimulationEngine(store, metro, offices, score_func=score_func, seed=seed, routing=routing)
+        self.trucks = self.engine.trucks
+        self.trucks.truck_pos = np.array(starts, dtype=np.int64)
+        self.rng = np.random.default_rng(seed)
+        self.ride = np.maximum(self.engine.scooters.path_len - 1, 1)  # turns from metro to each office
+        self.arrivals = np.zeros((self.ride.max() + 1, len(offices)), dtype=np.int64)  # ring buffer by turn
+        self.scooters_office = np.zeros(len(offices), dtype=np.int64)
+        self.riding = 0
+
+    def step(self, turn, rides):
+        """
+        Run a turn of the region, in the order SimulationEngine runs it.
+
+        Args:
+            turn int: current turn number
+            rides array(int): rides that left the metro in the previous turn, per office of the region
+
+        Returns:
+            (int, int, int, int, int): scooters returning to metro by themselves, which can be
+                used in this turn, scooters delivered by trucks, which can be used from the next
+                turn, scooters riding, scooters picked up and steps taken by trucks so far
+        """
+        horizon = len(self.arrivals)
+        self.arrivals[(turn - 1 + self.ride) % horizon, np.arange(len(rides))] += rides
+        self.riding += int(rides.sum())
+        back = self.rng.binomial(self.scooters_office, SimulateScooters.REPLENISH)
+        self.scooters_office -= back
+        arrived = self.arrivals[turn % horizon].copy()
+        self.arrivals[turn % horizon] = 0
+        self.scooters_office += arrived
+        self.riding -= int(arrived.sum())
+        self.engine.plan_paths(self.scooters_office)
+        delivered, self.scooters_office, _ = self.trucks.update_truck_pos(0, self.scooters_office)
+        return int(back.sum()), int(delivered), self.riding, int(self.trucks.scooters_picked), \
+            int(self.trucks.dist_travelled)
+
+
+class ShardedSimulation:
+
+    def __init__(self, store, metro=None, offices=None, shards=2, score_func="aging", seed=None, routing='hops',
+                 demand=None):
+        """
+        Splits the offices into regions of nearly equal size, see partition,
+        and runs each region in its own process. The metro, with its waiting
+        customers and parked scooters, stays in this process. Every turn each
+        region gets one message with the rides sent its way and answers with
+        one message of returned and delivered scooters and its counters, so
+        regions work in parallel and global metrics are merged once per turn.
+        Trucks are split between regions by number of offices and start at
+        nodes of their region, they only serve offices of their region.
+
+        Only the offices are partitioned, this is an approximation of the
+        turn based engine rather than a split of the city: every region
+        memory-maps the whole road network and builds routing trees for the
+        metro and its own offices over it, and trucks never cross into
+        another region. The per turn messages cost more than a turn of a
+        small city, so sharding only pays off when planning a region takes
+        well over a millisecond per turn and there is a core per region.
+
+        Args:
+            store GraphStore: road network arrays
+            metro int: osm id of metro node
+            offices List(int): osm ids of office nodes
+            shards int: number of regions and worker processes
+            score_func str: scoring for trucks, see SimulationEngine
+            seed int: seed of all random draws
+            routing str: see SimulationEngine
+            demand DemandProfile: customer arrivals and destinations, see SimulationEngine
+        """
+        metro = SimulationEngine.METRO if metro is None else metro
+        if isinstance(metro, (list, tuple)):
+            raise ValueError("the sharded simulation supports a single hub")
+        offices = list(SimulationEngine.OFFICES if offices is None else offices)
+        if not 0 < shards <= min(len(offices), SimulateTrucks.NUMBER):
+            raise ValueError("shards must be between 1 and the number of offices and of trucks")
+        self.store = store
+        self.metro_id = metro
+        self.office_ids = offices
+        self.rng = np.random.default_rng(seed)
+        self.demand = demand if demand is not None else DemandProfile(SimulateScooters.IN_RATE)
+        office_idx = np.array([store.index(osmid) for osmid in offices], dtype=np.int64)
+        self.region = self.partition(store.x[office_idx], store.y[office_idx], shards)  # region of each office
+        self.local = np.zeros(len(offices), dtype=np.int64)  # position of each office within its region
+        for k in range(shards):
+            members = np.flatnonzero(self.region == k)
+            self.local[members] = np.arange(len(members))
+        self.sizes = np.bincount(self.region, minlength=shards)
+
+        self.que = deque()  # [expiry turn, customers] of waiting customers in arrival order
+        self.scooters_metro = SimulateScooters.SCOOTERS_TOTAL
+        self.customers_served = 0
+        self.customers_dropped = 0
+        self.total_waiting_time = 0
+        self.under_utilization = 0
+        self.rides = [np.zeros(size, dtype=np.int64) for size in self.sizes]  # rides sent in the last turn
+        self.turn = 0
+        self.observers = []
+
+        # workers memory-map the graph instead of receiving a copy, until close
+        self.resources = contextlib.ExitStack()
+        store_path = self.resources.enter_context(store.shared())
+        constants = {name: getattr(cls, name) for name, cls in PARAMETERS.items()}
+        seeds = np.random.SeedSequence(seed).spawn(shards)
+        starts = self.truck_starts(office_idx, self.trucks_per_region())
+        self.connections = []
+        self.workers = []
+        for k in range(shards):
+            conn, child = Pipe()
+            worker = Process(target=_shard_worker, daemon=True, args=(
+                child, store_path, metro, [offices[i] for i in np.flatnonzero(self.region == k)], starts[k],
+                score_func, int(seeds[k].generate_state(1)[0]), routing, constants))
+            worker.start()
+            self.connections.append(conn)
+            self.workers.append(worker)
+
+    @staticmethod
+    def partition(x, y, parts):
+        """
+        Split points into parts of nearly equal size by cutting them at the
+        median of the longer side of their bounding box, recursively.
+
+        Args:
+            x array(float): longitude of each point
+            y array(float): latitude of each point
+            parts int: number of parts
+
+        Returns:
+            array(int): part of each point
+        """
+        x = x * np.cos(np.radians(np.mean(y)))  # so that both sides are in the same unit
+        labels = np.zeros(len(x), dtype=np.int64)
+        pending = [(np.arange(len(x)), parts, 0)]
+        while pending:
+            members, count, first = pending.pop()
+            if count == 1:
+                labels[members] = first
+                continue
+            side = x[members] if np.ptp(x[members]) >= np.ptp(y[members]) else y[members]
+            ordered = members[np.argsort(side, kind='stable')]
+            half = count // 2
+            cut = len(members) * half // count
+            pending += [(ordered[:cut], half, first), (ordered[cut:], count - half, first + half)]
+        return labels
+
+    def trucks_per_region(self):
+        """
+        Trucks of each region in proportion to its offices, at least one each.
+        """
+        share = self.sizes * (SimulateTrucks.NUMBER - len(self.sizes)) / self.sizes.sum()
+        trucks = 1 + np.floor(share).astype(np.int64)
+        left = SimulateTrucks.NUMBER - trucks.sum()
+        trucks[np.argsort(np.floor(share) - share, kind='stable')[:left]] += 1
+        return trucks
+
+    def truck_starts(self, office_idx, trucks):
+        """
+        Random start nodes for the trucks of each region, among the nodes
+        closest to an office of the region.
+
+        Returns:
+            List(List(int)): node positions per region
+        """
+        x, y = self.store.x, self.store.y
+        closest = np.empty(len(self.store), dtype=np.int64)
+        for start in range(0, len(self.store), 4096):
+            block = slice(start, start + 4096)
+            dist = np.hypot(x[block, None] - x[office_idx], y[block, None] - y[office_idx])
+            closest[block] = self.region[np.argmin(dist, axis=1)]
+        return [self.rng.choice(np.flatnonzero(closest == k), size=count).tolist() for k, count in enumerate(trucks)]
+
+    def add_observer(self, observer):
+        """
+        Args:
+            observer: callable taking the simulation and the TurnMetrics of the finished turn
+        """
+        self.observers.append(observer)
+
+    def serve(self, turn):
+        """
+        Drop the customers whose waiting time ran out and serve the others in
+        arrival order, as SimulateScooters.serve does.
+
+        Returns:
+            int: customers served
+        """
+        if self.que and self.que[0][0] == turn:
+            self.customers_dropped += self.que.popleft()[1]
+        served = 0
+        while self.que and self.scooters_metro:
+            cohort = self.que[0]
+            take = min(cohort[1], self.scooters_metro)
+            cohort[1] -= take
+            self.scooters_metro -= take
+            self.customers_served += take
+            self.total_waiting_time += take * (SimulateScooters.WAITING_TIME + turn - cohort[0])
+            served += take
+            if not cohort[1]:
+                self.que.popleft()
+        return served
+
+    def step(self):
+        """
+        Advance all regions by one turn
+
+        Returns:
+            TurnMetrics: metrics merged over all regions
+        """
+        turn = self.turn
+        for conn, rides in zip(self.connections, self.rides):
+            conn.send((turn, rides))
+        back, delivered, riding, picked, dist = np.array([conn.recv() for conn in self.connections]).sum(axis=0)
+
+        self.scooters_metro += int(back)
+        served = self.serve(turn)
+        offices = np.bincount(self.demand.destinations(served, len(self.office_ids), self.rng),
+                              minlength=len(self.office_ids))
+        self.rides = [np.zeros(size, dtype=np.int64) for size in self.sizes]
+        for office_id in np.flatnonzero(offices).tolist():
+            self.rides[self.region[office_id]][self.local[office_id]] = offices[office_id]
+        customers = self.demand.arrivals(turn, self.rng)
+        if customers:
+            self.que.append([turn + SimulateScooters.WAITING_TIME, customers])
+        self.under_utilization += SimulateScooters.SCOOTERS_TOTAL - int(riding) - served
+        self.scooters_metro += int(delivered)
+
+        avg_waiting_time = self.total_waiting_time / self.customers_served if self.customers_served else 0
+        under_utilization = self.under_utilization / (SimulateScooters.SCOOTERS_TOTAL * turn) if turn else 0
+        truck_utilization = picked / (SimulateTrucks.NUMBER * dist) if dist else 0
+        metrics = TurnMetrics(turn, avg_waiting_time, self.customers_dropped, under_utilization, truck_utilization)
+        self.turn += 1
+        for observer in self.observers:
+            observer(self, metrics)
+        return metrics
+
+    def run(self, n_turns):
+        """
+        Args:
+            n_turns int: number of turns to simulate
+
+        Returns:
+            List(TurnMetrics): metrics for each turn
+        """
+        return [self.step() for _ in range(n_turns)]
+
+    def close(self):
+        for conn in self.connections:
+            conn.send(None)
+        for worker in self.workers:
+            worker.join()
+        self.connections, self.workers = [], []
+        self.resources.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
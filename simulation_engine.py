@@ -0,0 +1,249 @@
+import copy
+import random
+from collections import namedtuple
+from functools import partial
+
+from graph_store import GraphStore
+from profiler import PhaseProfiler
+from routing import LandmarkRouter, RoutingIndex
+from scooter_simulation import SimulateScooters
+from snapshot import Snapshot
+from truck_simulation import SimulateTrucks
+
+TurnMetrics = namedtuple('TurnMetrics', ['turn', 'avg_waiting_time', 'customers_dropped', 'under_utilization',
+                                         'truck_utilization'])
+
+
+class SimulationEngine:
+    CENTER = (12.985660, 77.645015)  # center of sampled road network
+    DISTANCE = 2000  # distance in meters from center
+    METRO = 1563273556  # osm id of metro node
+    OFFICES = [6536735148, 6536735146, 1132680459, 1132675346, 1339408165,
+               1328155440, 1500759513, 1485686869, 3885545484, 1808901710]  # osm ids of office nodes
+
+    ROUTING = ('hops',) + LandmarkRouter.WEIGHTS
+    # (component, method, phase) timed when profiling, None for methods of the engine itself
+    PROFILED = [(None, 'step', PhaseProfiler.TURN), ('scooters', 'turn', 'scooters'), (None, 'plan_paths', 'plan'),
+                ('trucks', 'update_truck_pos', 'trucks'), (None, 'notify', 'observers')]
+    ROUTING_QUERIES = ('path_index', 'distance_index', 'distances_index')
+    FLEET = True  # position and state of every scooter are kept up to date, so the fleet can be drawn
+
+    def __init__(self, store, metro=None, offices=None, score_func="aging", seed=None, routing='hops',
+                 demand=None):
+        """
+        Runs scooters and trucks turn by turn without any rendering. Observers
+        attached with add_observer are called after every turn.
+
+        Args:
+            store GraphStore: road network arrays
+            metro int: osm id of metro node, or list of osm ids of transit hubs with the metro first
+            offices List(int): osm ids of office nodes
+            score_func str: 'aging', 'greedy', 'combined' or any other scoring registered with
+                SimulateTrucks.register_score, 'brute' for exact multi-office tours or 'assignment'
+                for matching all idle trucks at once
+            seed int: seed for the random module, left untouched if None
+            routing str: 'hops' to count every edge as one step, 'length' or 'time' to route
+                by edge length or driving time, distances in scores are then in meters or seconds
+            demand DemandProfile: customer arrivals and destinations, IN_RATE per turn to any office if None
+        """
+        if routing not in SimulationEngine.ROUTING:
+            raise ValueError("routing must be one of {}".format(", ".join(SimulationEngine.ROUTING)))
+        if seed is not None:
+            random.seed(seed)
+        metro = SimulationEngine.METRO if metro is None else metro
+        offices = SimulationEngine.OFFICES if offices is None else offices
+        self.store = store
+        self.hub_ids = list(metro) if isinstance(metro, (list, tuple)) else [metro]
+        self.metro_id = self.hub_ids[0]
+        self.office_ids = list(offices)
+        self.hubs = [store.node(osmid) for osmid in self.hub_ids]
+        self.metro = self.hubs[0]
+        self.offices = [store.node(osmid) for osmid in offices]
+        if routing == 'hops':
+            self.router = RoutingIndex(store, self.hub_ids + self.office_ids)
+        else:
+            self.router = LandmarkRouter.cached(store, self.hub_ids + self.office_ids, weight=routing)
+        self.scooters = SimulateScooters(None, self.offices, self.metro, router=self.router, demand=demand,
+                                         hub_nodes=self.hubs)
+        self.trucks = SimulateTrucks(None, self.offices, self.metro, router=self.router, hub_nodes=self.hubs)
+        self.set_strategy(score_func)
+        self.turn = 0
+        self.observers = []
+        self.profiler = None
+
+    def set_strategy(self, score_func):
+        """
+        Args:
+            score_func str: scoring for trucks, see __init__
+        """
+        self.strategy = score_func
+        self.score_func = None
+        if score_func == "brute":
+            self.plan_paths = self.trucks.brute_algo
+        elif score_func == "assignment":
+            self.plan_paths = self.trucks.assign_paths
+        elif score_func in SimulateTrucks.SCORES:
+            self.score_func = SimulateTrucks.SCORES[score_func][0]
+            self.plan_paths = partial(self.trucks.calculate_path, score_func=score_func)
+        else:
+            raise ValueError("score_func must be one of {}".format(
+                ", ".join(["brute", "assignment"] + list(SimulateTrucks.SCORES))))
+
+    @staticmethod
+    def load_store(graph_file=None):
+        """
+        Road network for the default scenario, or from a local extract.
+
+        Args:
+            graph_file str: path to a .graphml or .osm file
+
+        Returns:
+            GraphStore
+        """
+        if graph_file:
+            return GraphStore.from_file(graph_file)
+        return GraphStore.from_point(SimulationEngine.CENTER, SimulationEngine.DISTANCE, network_type='drive')
+
+    def add_observer(self, observer):
+        """
+        Args:
+            observer: callable taking the engine and the TurnMetrics of the finished turn
+        """
+        self.observers.append(observer)
+
+    def profile(self, profiler=None):
+        """
+        Time every phase of every turn from now on, including routing queries
+        and observers such as drawing.
+
+        Args:
+            profiler PhaseProfiler: profiler to record into, a new one if None
+
+        Returns:
+            PhaseProfiler
+        """
+        if self.profiler is not None:
+            return self.profiler
+        self.profiler = profiler if profiler is not None else PhaseProfiler()
+        for component, method, phase in self.PROFILED:
+            if phase == 'plan':
+                phase = 'plan[{}]'.format(self.strategy)
+            self.profiler.instrument(getattr(self, component) if component else self, method, phase)
+        for method in SimulationEngine.ROUTING_QUERIES:
+            self.profiler.instrument(self.router, method, 'routing')
+        self.profiler.add_counter('routing_hits', lambda: self.router.hits)
+        self.profiler.add_counter('routing_misses', lambda: self.router.misses)
+        return self.profiler
+
+    def get_state(self):
+        """
+        Returns:
+            dict: state of the engine, scooters and trucks, see Snapshot
+        """
+        version, internal, gauss = random.getstate()
+        engine = {'kind': type(self).__name__, 'turn': self.turn, 'strategy': self.strategy,
+                  'hubs': [int(osmid) for osmid in self.hub_ids], 'offices': [int(osmid) for osmid in self.office_ids],
+                  'random': [version, list(internal), gauss]}
+        return {'engine': engine, 'scooters': self.scooters.get_state(), 'trucks': self.trucks.get_state()}
+
+    def set_state(self, state, restore_random=True):
+        """
+        Continue from a state returned by get_state. The state of the random
+        module is restored too, as the engine seeds it.
+
+        Args:
+            state dict: as returned by get_state
+            restore_random bool: False to leave the random module as it is, e.g. for a fork
+        """
+        engine = state['engine']
+        if engine['kind'] != type(self).__name__:
+            raise ValueError("state of a {} cannot be restored into a {}".format(engine['kind'], type(self).__name__))
+        if engine['hubs'] != list(self.hub_ids) or engine['offices'] != list(self.office_ids):
+            raise ValueError("state was taken with different hubs or offices")
+        if restore_random:
+            version, internal, gauss = engine['random']
+            random.setstate((version, tuple(internal), gauss))
+        self.turn = engine['turn']
+        self.scooters.set_state(state['scooters'])
+        self.trucks.set_state(state['trucks'])
+
+    def snapshot(self):
+        """
+        Returns:
+            Snapshot: state at the start of the current turn, save it to checkpoint a run
+        """
+        return Snapshot.encode(self.get_state())
+
+    def restore(self, snapshot):
+        """
+        Continue from a snapshot, e.g. one loaded from a checkpoint with
+        Snapshot.load. The engine has to be built for the same network,
+        hubs, offices and class constants.
+        """
+        self.set_state(snapshot.decode())
+
+    def fork(self, score_func=None, snapshot=None):
+        """
+        New engine continuing from a snapshot, sharing the road network,
+        routing tables and ride paths with this one, so only the changing
+        state is copied. Observers and profiling are not carried over, and
+        the random module this engine draws from is left untouched.
+
+        Args:
+            score_func str: scoring for trucks of the new engine, the same as this one if None
+            snapshot Snapshot: state to continue from, the current state if None
+
+        Returns:
+            SimulationEngine: engine of the same kind
+        """
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        engine = copy.copy(self)
+        engine.scooters = copy.copy(self.scooters)
+        engine.trucks = copy.copy(self.trucks)
+        # a router of its own over the same tables, with its own hit counts
+        engine.router = copy.copy(self.router)
+        engine.scooters.router = engine.trucks.router = engine.router
+        # drop timed wrappers installed by a profiler of this engine
+        for component, method, _ in self.PROFILED:
+            vars(getattr(engine, component) if component else engine).pop(method, None)
+        for method in SimulationEngine.ROUTING_QUERIES:
+            vars(engine.router).pop(method, None)
+        engine.observers = []
+        engine.profiler = None
+        engine.set_strategy(self.strategy if score_func is None else score_func)
+        engine.set_state(snapshot.decode(), restore_random=False)
+        return engine
+
+    def notify(self, metrics):
+        for observer in self.observers:
+            observer(self, metrics)
+
+    def step(self):
+        """
+        Advance scooters and trucks by one turn
+
+        Returns:
+            TurnMetrics: metrics logged for the turn
+        """
+        turn = self.turn
+        avg_waiting_time, customers_dropped, under_utilization = self.scooters.turn(turn)
+        self.plan_paths(self.scooters.scooters_office)
+        hubs, office, (truck_utilization,) = self.trucks.update_truck_pos(self.scooters.scooters_hub,
+                                                                          self.scooters.scooters_office)
+        self.scooters.scooters_hub = hubs
+        self.scooters.scooters_office = office
+        self.scooters.move_by_trucks()
+        metrics = TurnMetrics(turn, avg_waiting_time, customers_dropped, under_utilization, truck_utilization)
+        self.turn += 1
+        self.notify(metrics)
+        return metrics
+
+    def run(self, n_turns):
+        """
+        Args:
+            n_turns int: number of turns to simulate
+
+        Returns:
+            List(TurnMetrics): metrics for each turn
+        """
+        return [self.step() for _ in range(n_turns)]
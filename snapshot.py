@@ -0,0 +1,78 @@
+import io
+import json
+import os
+
+import numpy as np
+
+
+class Snapshot:
+    VERSION = 3  # bumped whenever the layout of the state changes
+
+    def __init__(self, data):
+        """
+        Full state of a simulation at the start of a turn, in a compact binary
+        form: numpy arrays in an npz archive, other values, random generator
+        states included, as one JSON entry of the archive. Every decode builds
+        new arrays, so any number of engines can be restored from the same
+        snapshot without sharing state.
+
+        Args:
+            data bytes: encoded state, see encode
+        """
+        self.data = data
+
+    @classmethod
+    def encode(cls, state):
+        """
+        Args:
+            state dict: section name -> {name: array or JSON serializable value}
+
+        Returns:
+            Snapshot
+        """
+        arrays, values = {}, {}
+        for section, entries in state.items():
+            for name, value in entries.items():
+                if isinstance(value, np.ndarray):
+                    arrays['{}.{}'.format(section, name)] = value
+                else:
+                    values.setdefault(section, {})[name] = value
+        meta = json.dumps({'version': cls.VERSION, 'values': values}).encode()
+        buffer = io.BytesIO()
+        np.savez(buffer, meta=np.frombuffer(meta, dtype=np.uint8), **arrays)
+        return cls(buffer.getvalue())
+
+    def decode(self):
+        """
+        Returns:
+            dict: state as passed to encode
+        """
+        with np.load(io.BytesIO(self.data)) as archive:
+            meta = json.loads(archive['meta'].tobytes().decode())
+            if meta['version'] != Snapshot.VERSION:
+                raise ValueError("snapshot version {} is not supported, expected {}".format(meta['version'],
+                                                                                            Snapshot.VERSION))
+            state = meta['values']
+            for key in archive.files:
+                if key != 'meta':
+                    section, name = key.split('.', 1)
+                    state.setdefault(section, {})[name] = archive[key]
+        return state
+
+    def save(self, path):
+        """
+        Write the snapshot as a checkpoint file, replacing an older one only
+        once it is complete.
+        """
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.data)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls(f.read())
+
+    def __len__(self):
+        return len(self.data)
@@ -0,0 +1,96 @@
+import heapq
+
+import numpy as np
+
+
+class KDTree:
+    LEAF_SIZE = 16  # points scanned at once in a leaf
+
+    def __init__(self, points):
+        """
+        Static 2-d tree for nearest neighbour queries in logarithmic time. Every
+        inner node splits its points at the median of the coordinate they are
+        most spread along. Trees over longitude and latitude should be built
+        from planar(x, y).
+
+        Args:
+            points array(float): n x 2 coordinates
+        """
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self.order = np.arange(len(self.points))  # point ids, each node owns a contiguous range
+        self.start, self.end, self.dim, self.split, self.left, self.right = [], [], [], [], [], []
+        if len(self.points):
+            self.build(0, len(self.points))
+
+    @staticmethod
+    def planar(x, y):
+        """
+        Longitude and latitude scaled to the same unit around their mean
+        latitude, good enough for distances within a city.
+
+        Returns:
+            array(float): n x 2 coordinates
+        """
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        return np.c_[x * np.cos(np.radians(y.mean())) if len(y) else x, y]
+
+    def build(self, start, end):
+        node = len(self.start)
+        self.start.append(start)
+        self.end.append(end)
+        for table in (self.dim, self.split, self.left, self.right):
+            table.append(-1)
+        if end - start <= KDTree.LEAF_SIZE:
+            return node
+        ids = self.order[start:end]
+        coords = self.points[ids]
+        dim = int(np.argmax(coords.max(axis=0) - coords.min(axis=0)))
+        mid = (end - start) // 2
+        self.order[start:end] = ids[np.argpartition(coords[:, dim], mid)]
+        self.dim[node] = dim
+        self.split[node] = float(self.points[self.order[start + mid], dim])
+        self.left[node] = self.build(start, start + mid)
+        self.right[node] = self.build(start + mid, end)
+        return node
+
+    def query(self, point, k=1):
+        """
+        The k points closest to the given one.
+
+        Args:
+            point (float, float): coordinates, in the unit of the tree
+            k int: number of neighbours
+
+        Returns:
+            (array(int), array(float)): ids of the points, closest first, and their distances
+        """
+        if not len(self.points):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        point = np.asarray(point, dtype=np.float64)
+        k = min(k, len(self.points))
+        best = []  # heap of (-squared distance, id) of the k closest points seen
+        pending = [(0., 0)]  # (squared distance to the region of node, node)
+        while pending:
+            bound, node = pending.pop()
+            if len(best) == k and bound >= -best[0][0]:
+                continue
+            if self.dim[node] < 0:
+                ids = self.order[self.start[node]:self.end[node]]
+                squared = ((self.points[ids] - point) ** 2).sum(axis=1)
+                for d, i in zip(squared.tolist(), ids.tolist()):
+                    if len(best) < k:
+                        heapq.heappush(best, (-d, i))
+                    elif d < -best[0][0]:
+                        heapq.heapreplace(best, (-d, i))
+                continue
+            gap = point[self.dim[node]] - self.split[node]
+            near, far = (self.left[node], self.right[node]) if gap < 0 else (self.right[node], self.left[node])
+            # the near side is searched first, it is on top of the stack
+            pending.append((max(bound, gap * gap), far))
+            pending.append((bound, near))
+        best.sort(reverse=True)
+        return (np.array([i for _, i in best], dtype=np.int64),
+                np.sqrt(np.array([-d for d, _ in best], dtype=np.float64)))
+
+    def __len__(self):
+        return len(self.points)
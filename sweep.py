@@ -0,0 +1,208 @@
+import csv
+import itertools as itr
+import json
+import math
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from graph_store import GraphStore
+from scooter_simulation import SimulateScooters
+from simulation_engine import SimulationEngine
+from truck_simulation import SimulateTrucks
+
+# class constants that can be swept
+PARAMETERS = {
+    'IN_RATE': SimulateScooters,
+    'WAITING_TIME': SimulateScooters,
+    'SCOOTERS_TOTAL': SimulateScooters,
+    'REPLENISH': SimulateScooters,
+    'NUMBER': SimulateTrucks,
+    'CAPACITY': SimulateTrucks,
+    'COMBINED_RATIO': SimulateTrucks,
+}
+DEFAULTS = {name: getattr(cls, name) for name, cls in PARAMETERS.items()}
+METRICS = ['avg_waiting_time', 'customers_dropped', 'under_utilization', 'truck_utilization']
+# two sided 95% quantiles of student's t distribution for 1 to 30 degrees of freedom
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+_store = None  # road network of worker process, memory-mapped once per worker
+_scenario = {}  # scenario every run of the worker starts from, see ScenarioConfig
+
+
+def _init_worker(store_path, scenario):
+    global _store, _scenario
+    _store = GraphStore.load(store_path)
+    _scenario = scenario
+
+
+def parse_strategy(strategy):
+    """
+    Strategies are 'aging', 'greedy', 'combined' or 'combined:<a>' where a
+    is the weight of the aging score.
+
+    Returns:
+        (str, dict): score function name and parameters it sets
+    """
+    name, _, ratio = strategy.partition(':')
+    return name, ({'COMBINED_RATIO': float(ratio)} if ratio else {})
+
+
+def run_one(task):
+    """
+    Run a single simulation in a worker process.
+
+    Args:
+        task (int, dict, str, int, int): run id, parameters, strategy, seed and number of turns
+
+    Returns:
+        dict: parameters of the run and its metrics after the last turn
+    """
+    from scenario_config import ScenarioConfig
+
+    run_id, params, strategy, seed, turns = task
+    score_func, extra = parse_strategy(strategy)
+    # workers are reused, start every run from the default constants
+    for name, value in DEFAULTS.items():
+        setattr(PARAMETERS[name], name, value)
+    start = time.time()
+    engine = ScenarioConfig(_scenario).engine(_store, score_func, seed, constants=dict(params, **extra))
+    metrics = engine.run(turns)[-1]
+    row = {'run': run_id, 'strategy': strategy, 'seed': seed}
+    row.update(params)
+    row.update({name: float(getattr(metrics, name)) for name in METRICS})
+    row['seconds'] = round(time.time() - start, 3)
+    return row
+
+
+def confidence_interval(values):
+    """
+    Returns:
+        (float, float): mean and half width of the 95% confidence interval
+    """
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2:
+        return mean, float('nan')
+    std = math.sqrt(sum((v - mean) ** 2 for v in values) / (n - 1))
+    t = T_95[n - 2] if n - 1 <= len(T_95) else 1.96
+    return mean, t * std / math.sqrt(n)
+
+
+class Sweep:
+
+    def __init__(self, store, grid, strategies, seeds, turns, output, processes=None, scenario=None):
+        """
+        Runs the simulation for every combination of parameter values, scoring
+        strategy and seed over a process pool.
+
+        Args:
+            store GraphStore: road network shared read-only by all workers
+            grid dict(str, List): values for each name in PARAMETERS
+            strategies List(str): scoring strategies, see parse_strategy
+            seeds List(int): random seeds
+            turns int: number of turns per run
+            output str: csv file for per run metrics, the summary goes next to it
+            processes int: worker processes, number of cpus if None
+            scenario dict: values of a scenario file, see ScenarioConfig, the defaults of the simulation
+                if None. Its hubs, offices, constants, demand, routing and engine apply to every run,
+                the strategies, seeds and turns of the sweep replace its own.
+        """
+        unknown = set(grid) - set(PARAMETERS)
+        if unknown:
+            raise ValueError("cannot sweep {}".format(", ".join(sorted(unknown))))
+        self.store = store
+        self.grid = grid
+        self.strategies = strategies
+        self.seeds = seeds
+        self.turns = turns
+        self.output = output
+        self.processes = processes
+        # the network reaches workers as the store, the rest of each run comes with its task
+        self.scenario = {key: value for key, value in (scenario or {}).items()
+                         if key not in ('graph', 'strategy', 'seed', 'turns')}
+
+    def tasks(self):
+        names = sorted(self.grid)
+        combos = itr.product(*(self.grid[name] for name in names))
+        runs = itr.product(combos, self.strategies, self.seeds)
+        for run_id, (values, strategy, seed) in enumerate(runs):
+            yield run_id, dict(zip(names, values)), strategy, seed, self.turns
+
+    def run(self):
+        """
+        Run all tasks, writing each finished run to the output file as soon as
+        it arrives.
+
+        Returns:
+            List(dict): per run rows
+        """
+        fields = ['run', 'strategy', 'seed'] + sorted(self.grid) + METRICS + ['seconds']
+        rows = []
+        # workers memory-map the graph instead of receiving it with every task
+        with self.store.shared() as store_path, open(self.output, 'w', newline='') as f, \
+                Pool(self.processes, initializer=_init_worker, initargs=(store_path, self.scenario)) as pool:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for row in pool.imap_unordered(run_one, self.tasks()):
+                writer.writerow(row)
+                f.flush()
+                rows.append(row)
+        self.write_summary(rows)
+        return rows
+
+    def write_summary(self, rows):
+        """
+        Aggregate runs over seeds into mean and 95% confidence interval of each metric.
+        """
+        keys = sorted(self.grid) + ['strategy']
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row[key] for key in keys), []).append(row)
+        root, ext = os.path.splitext(self.output)
+        with open(root + '_summary' + (ext or '.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(keys + ['runs'] + [m + suffix for m in METRICS for suffix in ('_mean', '_ci95')])
+            for group, members in sorted(groups.items(), key=lambda item: repr(item[0])):
+                stats = []
+                for metric in METRICS:
+                    stats.extend(confidence_interval([member[metric] for member in members]))
+                writer.writerow(list(group) + [len(members)] + stats)
+
+
+def run_sweep(path):
+    """
+    Run the sweep described by a json file, see __main__.
+
+    Returns:
+        List(dict): per run rows
+    """
+    with open(path) as config_file:
+        config = json.load(config_file)
+    if 'scenario' in config:
+        from scenario_config import ScenarioConfig
+        scenario = ScenarioConfig.load(config['scenario'])
+        graph = scenario.load_store()
+        # the strategy, seed and turns of the scenario are the defaults of the sweep
+        defaults = {'strategies': [scenario.strategy], 'seeds': [scenario.seed],
+                    'turns': scenario.turns}
+    else:
+        scenario = None
+        graph = SimulationEngine.load_store(config.get('graph_file'))
+        defaults = {'strategies': ['aging'], 'seeds': [25], 'turns': 100}
+    config = dict(defaults, **config)
+    return Sweep(graph, config.get('grid', {}), config['strategies'], config['seeds'], config['turns'],
+                 config['output'], config.get('processes'), scenario.config if scenario else None).run()
+
+
+if __name__ == "__main__":
+    """
+    Pass a json file with keys 'grid', 'strategies', 'seeds', 'turns' and
+    'output', and optionally 'processes' and 'graph_file' or 'scenario', a
+    scenario file giving the road network and everything else about the runs
+    but what the sweep sets.
+    """
+    run_sweep(sys.argv[1])
@@ -0,0 +1,123 @@
+import numpy as np
+
+DP_LIMIT = 12  # largest number of candidate offices solved by dynamic programming
+
+
+def plan_tour(start_dist, office_dist, metro_dist, available, capacity, score):
+    """
+    Find the order of offices a truck should visit before unloading at the
+    metro. A tour goes from the truck position through one or more offices
+    and ends at the metro, it picks up min(capacity, scooters available on the
+    tour) and is scored with score(picked, distance of the tour).
+
+    Offices with no scooters are never visited. Distances must be shortest
+    path distances, so visiting an office never shortens a tour, which lets
+    tours stop growing once the truck is full.
+
+    Args:
+        start_dist List(int): distance from truck to each office
+        office_dist array(int): distance between each pair of offices
+        metro_dist List(int): distance from each office to metro
+        available List(int): scooters at each office
+        capacity int: scooters the truck can still take
+        score: callable taking scooters picked and distance, vectorized over arrays
+
+    Returns:
+        (float, List(int)): best score and order of office indices, (None, []) if nothing can be picked
+    """
+    candidates = [i for i, qty in enumerate(available) if qty > 0]
+    if not candidates or capacity <= 0:
+        return None, []
+    start = np.asarray(start_dist, dtype=np.float64)[candidates]
+    dist = np.asarray(office_dist, dtype=np.float64)[np.ix_(candidates, candidates)]
+    metro = np.asarray(metro_dist, dtype=np.float64)[candidates]
+    qty = np.asarray(available, dtype=np.int64)[candidates]
+    if len(candidates) <= DP_LIMIT:
+        best, order = _dp_tour(start, dist, metro, qty, capacity, score)
+    else:
+        best, order = _branch_and_bound_tour(start, dist, metro, qty, capacity, score)
+    return best, [candidates[i] for i in order]
+
+
+def _dp_tour(start, dist, metro, qty, capacity, score):
+    """
+    Bitmask dynamic programming, dp[mask, j] is the shortest walk from the
+    truck through the offices in mask ending at office j.
+    """
+    n = len(start)
+    size = 1 << n
+    bits = 1 << np.arange(n)
+    members = (np.arange(size)[:, None] & bits) > 0
+    picked = np.minimum(members @ qty, capacity)
+    dp = np.full((size, n), np.inf)
+    parent = np.full((size, n), -1, dtype=np.int64)
+    dp[bits, np.arange(n)] = start
+    for mask in range(1, size):
+        # capacity pruning, extra offices only add distance to a full truck
+        if picked[mask] >= capacity:
+            continue
+        row = dp[mask]
+        if np.isinf(row).all():
+            continue
+        through = row[:, None] + dist
+        best_prev = through.argmin(axis=0)
+        cost = through[best_prev, np.arange(n)]
+        nxt = np.flatnonzero(~members[mask])
+        targets = mask | bits[nxt]
+        better = cost[nxt] < dp[targets, nxt]
+        dp[targets[better], nxt[better]] = cost[nxt][better]
+        parent[targets[better], nxt[better]] = best_prev[nxt][better]
+
+    total = dp + metro
+    last = total.argmin(axis=1)
+    scores = score(picked, total[np.arange(size), last])
+    scores[0] = -np.inf
+    mask = int(np.argmax(scores))
+    order = []
+    j = int(last[mask])
+    while j != -1:
+        order.append(j)
+        mask, j = mask ^ (1 << j), int(parent[mask, j])
+    order.reverse()
+    return float(scores.max()), order
+
+
+def _branch_and_bound_tour(start, dist, metro, qty, capacity, score):
+    """
+    Depth first search over tours, nearest office first. A branch is cut when
+    even picking up every remaining scooter at the distance of going straight
+    to the metro can not beat the best tour found.
+    """
+    n = len(start)
+    total_qty = int(qty.sum())
+    best = [-np.inf, []]
+    order = []
+    visited = [False] * n
+
+    def search(pos_dist, dist_so_far, picked):
+        here = order[-1]
+        finish = dist_so_far + metro[here]
+        tour_score = score(picked, finish)
+        if tour_score > best[0]:
+            best[0], best[1] = tour_score, list(order)
+        if picked >= capacity:
+            return
+        remaining = min(capacity, picked + total_qty - sum(qty[i] for i in order))
+        if score(remaining, finish) <= best[0]:
+            return
+        for j in np.argsort(pos_dist):
+            if visited[j]:
+                continue
+            visited[j] = True
+            order.append(j)
+            search(dist[j], dist_so_far + pos_dist[j], min(capacity, picked + int(qty[j])))
+            order.pop()
+            visited[j] = False
+
+    for j in np.argsort(start):
+        visited[j] = True
+        order.append(j)
+        search(dist[j], start[j], min(capacity, int(qty[j])))
+        order.pop()
+        visited[j] = False
+    return float(best[0]), [int(j) for j in best[1]]
@@ -1,40 +1,146 @@
-import itertools as itr
-from collections import deque
 from random import sample, randint
 
-import networkx as nx
+import numpy as np
 
-from scooter_simulation import SimulateScooters
+from graph_store import GraphStore
+from routing import RoutingIndex
+from spatial_index import KDTree
+from tour_planner import plan_tour
 
 
 class SimulateTrucks:
     NUMBER = 8  # number of trucks
     CAPACITY = 10  # capacity per truck
     SIZE = 60  # size of truck on graph
+    COMBINED_RATIO = 0.7  # weight of aging score in combined score
+    CANDIDATES = 32  # idle trucks nearest to an office considered for it by the assignment planner
+    SCORES = {}  # name -> (vectorized scoring function, whether it needs distances), see register_score
 
-    def __init__(self, G, office_nodes, metro_node):
+    def __init__(self, G, office_nodes, metro_node, router=None, hub_nodes=None):
+        """
+        Truck state is kept as node positions in the graph store: positions
+        in an int array and remaining paths as int arrays, so reaching the
+        a hub or an office is an integer comparison and an array lookup.
+        A full truck unloads at the hub closest to where it is, looked up in
+        a table of the nearest hub of every node.
+
+        Args:
+            G <graph object>: map of city, only used to build a router if none is given
+            office_nodes List(dict): office nodes
+            metro_node dict: metro node
+            router RoutingIndex: shortest paths to and from hubs and offices
+            hub_nodes List(dict): all transit hubs, metro_node first, only the metro if None
+        """
         self.map = G
-        self.offices = office_nodes
-        self.turns_without_visit = [1] * SimulateScooters.OFFICE_NUM
-        self.idle_prob = [randint(1, 30) / 100 for _ in range(SimulateScooters.OFFICE_NUM)]
-        self.office_mapping = {office['osmid']: i for i, office in enumerate(self.offices)}
-        self.metro = metro_node
-        self.truck_pos = [self.map.node.get(i) for i in sample(self.map.nodes, SimulateTrucks.NUMBER)]
+        hub_ids = [hub['osmid'] for hub in ([metro_node] if hub_nodes is None else hub_nodes)]
+        if router is None:
+            router = RoutingIndex(GraphStore.from_graph(G), hub_ids + [office['osmid'] for office in office_nodes])
+        self.router = router
+        self.store = router.store
+        self.metro = self.store.index(metro_node['osmid'])
+        self.hubs = np.array([self.store.index(osmid) for osmid in hub_ids], dtype=np.int64)
+        self.hub_at = np.full(len(self.store), -1, dtype=np.int64)  # hub id at each node, -1 elsewhere
+        self.hub_at[self.hubs] = np.arange(len(self.hubs))
+        self.nearest_hub = router.nearest(hub_ids)  # id of the hub closest to each node
+        self.offices = [self.store.index(office['osmid']) for office in office_nodes]
+        self.office_at = np.full(len(self.store), -1, dtype=np.int64)  # office id at each node, -1 elsewhere
+        self.office_at[self.offices] = np.arange(len(self.offices))
+        self.turns_without_visit = [1] * len(office_nodes)
+        self.idle_prob = [randint(1, 30) / 100 for _ in office_nodes]
+        self.truck_pos = np.array(sample(range(len(self.store)), SimulateTrucks.NUMBER), dtype=np.int64)
         self.truck_cap = [0] * SimulateTrucks.NUMBER
         self.next_steps = [None] * SimulateTrucks.NUMBER
         self.scooters_picked = 0
         self.dist_travelled = 0
+        # distances between fixed points for tour planning
+        self.office_dist = np.array([self.get_office_distances(src) for src in self.offices])
+        self.metro_dist = np.array([self.get_distance(office, self.unload_hub(office)) for office in self.offices])
+
+    def get_state(self):
+        """
+        Everything about the trucks that changes while simulating. Remaining
+        paths are stored one after the other, with length -1 for no path.
+
+        Returns:
+            dict: arrays and plain values, see Snapshot
+        """
+        paths = [steps for steps in self.next_steps if steps is not None]
+        return {
+            'truck_pos': self.truck_pos,
+            'truck_cap': np.array(self.truck_cap, dtype=np.int64),
+            'next_steps': np.concatenate(paths) if paths else np.empty(0, dtype=np.int64),
+            'next_steps_len': np.array([-1 if steps is None else len(steps) for steps in self.next_steps],
+                                       dtype=np.int64),
+            'turns_without_visit': np.array(self.turns_without_visit, dtype=np.int64),
+            'idle_prob': np.array(self.idle_prob, dtype=np.float64),
+            'scooters_picked': int(self.scooters_picked),
+            'dist_travelled': int(self.dist_travelled),
+        }
+
+    def set_state(self, state):
+        """
+        Continue from a state returned by get_state.
+        """
+        if len(state['truck_pos']) != len(self.truck_pos):
+            raise ValueError("state has {} trucks, expected {}".format(len(state['truck_pos']), len(self.truck_pos)))
+        self.truck_pos = state['truck_pos']
+        self.truck_cap = state['truck_cap'].tolist()
+        steps, offset = state['next_steps'], 0
+        self.next_steps = []
+        for length in state['next_steps_len'].tolist():
+            self.next_steps.append(None if length < 0 else steps[offset:offset + length])
+            offset += max(length, 0)
+        self.turns_without_visit = state['turns_without_visit'].tolist()
+        self.idle_prob = state['idle_prob'].tolist()
+        self.scooters_picked = state['scooters_picked']
+        self.dist_travelled = state['dist_travelled']
 
     def get_pos(self):
-        x = [pos['x'] for pos in self.truck_pos]
-        y = [pos['y'] for pos in self.truck_pos]
-        return x, y
+        return self.store.x[self.truck_pos], self.store.y[self.truck_pos]
 
     def get_size(self):
         return [(SimulateTrucks.SIZE + cap * cap) for cap in self.truck_cap]
 
     def get_shortest_path(self, src, dst):
-        return nx.shortest_path(self.map, src['osmid'], dst['osmid'])
+        return self.router.path_index(src, dst)
+
+    def get_steps(self, src, dst):
+        """
+        Nodes a truck at src moves through to reach dst, src excluded.
+        """
+        return np.array(self.get_shortest_path(src, dst)[1:], dtype=np.int64)
+
+    def pickup_steps(self, truck_id, office_id):
+        """
+        Nodes a truck moves through to reach an office, a truck already
+        standing at the office stays for a turn to pick up.
+        """
+        pos = self.truck_pos[truck_id]
+        steps = self.get_steps(pos, self.offices[office_id])
+        return steps if len(steps) else np.array([pos], dtype=np.int64)
+
+    def get_distance(self, src, dst):
+        return self.router.distance_index(src, dst)
+
+    def get_office_distances(self, src):
+        return self.router.distances_index(src, self.offices).tolist()
+
+    def unload_hub(self, pos):
+        """
+        Node position of the hub a full truck at pos unloads at.
+        """
+        return int(self.hubs[self.nearest_hub[pos]])
+
+    def unload_steps(self, truck_id):
+        """
+        Nodes a full truck moves through to reach the hub it unloads at.
+        """
+        pos = self.truck_pos[truck_id]
+        return self.get_steps(pos, self.unload_hub(pos))
+
+    def is_idle(self, truck_id):
+        steps = self.next_steps[truck_id]
+        return steps is None or not len(steps)
 
     def score_function(self, scooters, dist):
         """
@@ -49,194 +155,320 @@ class SimulateTrucks:
         """
         return 10 * scooters - 0.87 * dist - 175
 
-    def get_office_scooters(self, office_scooters, node):
-        return office_scooters[self.office_mapping[node['osmid']]]
-
-    def take_office_scooters(self, office_scooters, node, take):
-        office_scooters[self.office_mapping[node['osmid']]] -= take
-
     def brute_path_truck(self, truck_id, office_scooters):
         """
-        Try all orders of paths that can be taken, taking the order and the path
-        with maximum score.
+        Find the order of offices with maximum score for a truck, picking up
+        scooters along the way before unloading at a hub. The truck is sent
+        to the first office of the order, scooters at all offices of the order
+        are reserved.
 
         Args:
             truck_id - indicating truck concerned
             office_scooters List(int): speculated number of scooters at office locations
 
         Returns:
-            steps: chosen path
+            steps: chosen path, None if there is nothing to pick up
             office_scooters: remaining number of scooters at office locations
             best_score: score for the path
         """
         cur_cap = self.truck_cap[truck_id]
         cur_pos = self.truck_pos[truck_id]
-
-        def score_order_path(dist, cap_gained, cur_pos, order):
-            if not order or cap_gained + cur_cap == SimulateTrucks.CAPACITY:
-                return self.score(cap_gained, dist)
-            else:
-                dest = order[0]
-                path_len = len(self.get_shortest_path(cur_pos, dest))
-                cap_gained += min(SimulateTrucks.CAPACITY - cur_cap, self.get_office_scooters(office_scooters, dest))
-                self.take_office_scooters(office_scooters, dest, cap_gained)
-                score1 = score_order_path(dist + path_len, cap_gained, dest, order[1:])
-                path_len += len(nx.shortest_path(self.map, dest['osmid'], self.metro['osmid']))
-                score2 = self.score(cap_gained, path_len)
-                return max(score1, score2)
-
-        paths = [(score_order_path(0, 0, cur_pos, order), order) for order in
-                 itr.permutations(self.offices, len(self.offices)) if order[0] is not cur_pos]
-        paths.sort(key=lambda x: x[0], reverse=True)
-        best_score = paths[0][0]
-        steps = self.get_shortest_path(cur_pos, best_score[0])
-        steps = [self.map.node.get(i) for i in steps[1:]]
-        take = min(SimulateTrucks.CAPACITY - cur_cap, self.get_office_scooters(office_scooters, steps[-1]))
-        self.take_office_scooters(office_scooters, steps[-1], take)
-        return steps, office_scooters, best_score
+        start_dist = self.get_office_distances(cur_pos)
+        best_score, order = plan_tour(start_dist, self.office_dist, self.metro_dist, office_scooters,
+                                      SimulateTrucks.CAPACITY - cur_cap, self.score_function)
+        if not order:
+            return None, office_scooters, None
+        left = SimulateTrucks.CAPACITY - cur_cap
+        for office_id in order:
+            take = min(left, office_scooters[office_id])
+            office_scooters[office_id] -= take
+            left -= take
+        return self.pickup_steps(truck_id, order[0]), office_scooters, best_score
 
     def brute_algo(self, scooter_qty):
         """
-        Try all orders of trucks for all orders of paths that can be taken,
-        taking the best order which has the best cumulative score of all paths.
-        Method is called every time a truck completes and objective, resetting objectives
-        i.e. destination for all trucks.
+        Plan an exact multi-office tour for every idle truck, in truck order.
+        Method is called every turn, like calculate_path.
 
         Args:
             scooter_qty: number of scooters at office locations
         """
         office_scooters = list(scooter_qty)
         for truck_id in range(SimulateTrucks.NUMBER):
-            if not self.next_steps[truck_id]:
+            if self.is_idle(truck_id):
                 if self.truck_cap[truck_id] == SimulateTrucks.CAPACITY:
-                    steps = self.get_shortest_path(self.truck_pos[truck_id], self.metro)
-                    steps = [self.map.node.get(i) for i in steps[1:]]
-                    self.next_steps[truck_id] = deque(steps)
+                    self.next_steps[truck_id] = self.unload_steps(truck_id)
                 else:
                     steps, office_scooters, _ = self.brute_path_truck(truck_id, office_scooters)
-                    self.next_steps[truck_id] = deque(steps)
-
-    def aging_score(self, scooter_qty):
-        return [(a * b * c, i) for i, (a, b, c) in
-                enumerate(zip(scooter_qty, self.turns_without_visit, self.idle_prob))]
-
-    def best_aging_score(self, cur_pos, scooter_qty):
-        scores = self.aging_score(scooter_qty)
-        scores.sort(reverse=True, key=lambda x: x[0])
-        return scores[0]
-
-    def greedy_score(self, cur_pos, scooter_qty):
-        dist = [len(self.get_shortest_path(cur_pos, office)) for office in self.offices]
-        scooters = [min(SimulateTrucks.CAPACITY - self.truck_cap[i], scooter_qty[i]) for i in
-                    range(SimulateTrucks.NUMBER)]
-        return [(self.score_function(a, b), i) for i, (a, b) in enumerate(zip(scooters, dist))]
-
-    def best_greedy_score(self, cur_pos, scooter_qty):
-        score = self.greedy_score(cur_pos, scooter_qty)
-        score.sort(reverse=True, key=lambda x: x[0])
-        return score[0]
-
-    def combined_score(self, cur_pos, scooter_qty, a=0.7):
-        aging = self.aging_score(scooter_qty)
-        greedy = self.greedy_score(cur_pos, scooter_qty)
-        combined = [(age_score * a + greedy_score * (1 - a), i) for i, ((age_score, _), (greedy_score, _)) in
-                    enumerate(zip(aging, greedy))]
-        return combined
-
-    def best_combined_score(self, cur_pos, scooter_qty):
-        combined = self.combined_score(cur_pos, scooter_qty)
-        combined.sort(reverse=True, key=lambda x: x[0])
-        return combined[0]
+                    self.next_steps[truck_id] = steps
+
+    @classmethod
+    def register_score(cls, name, distances=True):
+        """
+        Decorator registering a vectorized scoring function under the name
+        passed as score_func to the engine. The function is called as
+        func(trucks, cap_left, scooters, dist, offices) with
+
+            trucks SimulateTrucks: the trucks being planned
+            cap_left array(int): scooters each scored truck can still take
+            scooters array(int): scooters at each scored office
+            dist array(float): trucks x offices distance matrix, None if not requested
+            offices array(int): ids of the scored offices
+
+        and returns scores broadcastable to trucks x offices, higher is better.
+
+        Args:
+            name str: name of the strategy
+            distances bool: whether the function needs distances from trucks to offices
+        """
+        def register(func):
+            cls.SCORES[name] = (func, distances)
+            return func
+        return register
+
+    def office_distance_matrix(self, truck_ids):
+        """
+        Returns:
+            array(float): distance from each of the given trucks to every office
+        """
+        return np.array([self.get_office_distances(self.truck_pos[i]) for i in truck_ids]).reshape(
+            len(truck_ids), len(self.offices))
+
+    @staticmethod
+    def score_matrix(func, trucks, cap_left, scooters, dist, offices):
+        scores = func(trucks, cap_left, scooters, dist, offices)
+        return np.broadcast_to(scores, (len(cap_left), len(offices))).astype(np.float64)
 
     def calculate_path(self, scooter_qty, score_func):
         """
         Calculates destination and path for all trucks that have,
         reached destination i.e. their next steps queue is None. Method
-        is called every turn.
+        is called every turn. All idle trucks are scored against all offices
+        at once, then in truck order each truck takes the office with the
+        best score, and only the column of that office is scored again for
+        the trucks after it. With more than CANDIDATES idle trucks an office
+        is only scored for its candidate trucks, see candidate_trucks, the
+        other pairs score -inf.
 
         Args:
             scooter_qty: number of scooters at office locations
-            score_func: choosing among aging, greedy or combined score to
-                decide paths to take
+            score_func str: name of a registered score, e.g. 'aging', 'greedy' or 'combined'
         """
-        office_scooters = list(scooter_qty)
+        office_scooters = np.array(scooter_qty, dtype=np.int64)
+        idle = []
         for truck_id in range(SimulateTrucks.NUMBER):
-            if not self.next_steps[truck_id]:
+            if self.is_idle(truck_id):
                 if self.truck_cap[truck_id] == SimulateTrucks.CAPACITY:
-                    steps = self.get_shortest_path(self.truck_pos[truck_id], self.metro)
-                    steps = [self.map.node.get(i) for i in steps[1:]]
-                    self.next_steps[truck_id] = deque(steps)
+                    self.next_steps[truck_id] = self.unload_steps(truck_id)
                 else:
-                    score, office_id = score_func(self.truck_pos[truck_id], office_scooters)
-                    take = min(SimulateTrucks.CAPACITY - self.truck_cap[truck_id], office_scooters[office_id])
-                    if not take:
-                        self.next_steps[truck_id] = None
-                    else:
-                        office_scooters[office_id] -= take
-                        path = self.get_shortest_path(self.truck_pos[truck_id], self.offices[office_id])
-                        self.next_steps[truck_id] = deque([self.map.node.get(i) for i in path[1:]])
+                    idle.append(truck_id)
+        if not idle:
+            return
+
+        func, distances = SimulateTrucks.SCORES[score_func]
+        offices = np.arange(len(self.offices))
+        cap_left = SimulateTrucks.CAPACITY - np.array([self.truck_cap[i] for i in idle], dtype=np.int64)
+        candidates = None
+        if len(idle) <= SimulateTrucks.CANDIDATES:
+            dist = self.office_distance_matrix(idle) if distances else None
+            scores = self.score_matrix(func, self, cap_left, office_scooters, dist, offices)
+        else:
+            candidates = self.candidate_trucks(idle, np.flatnonzero(office_scooters))
+            dist = self.candidate_distances(idle, candidates) if distances else None
+            scores = np.full((len(idle), len(offices)), -np.inf)
+            for office_id in np.flatnonzero(candidates.any(axis=0)).tolist():
+                rows = np.flatnonzero(candidates[:, office_id])
+                column = offices[office_id:office_id + 1]
+                scores[rows, office_id] = self.score_matrix(func, self, cap_left[rows], office_scooters[column],
+                                                            None if dist is None else dist[rows][:, column],
+                                                            column)[:, 0]
+        for row, truck_id in enumerate(idle):
+            office_id = int(np.argmax(scores[row]))
+            take = min(cap_left[row], office_scooters[office_id])
+            if not take or scores[row, office_id] == -np.inf:
+                self.next_steps[truck_id] = None
+                continue
+            office_scooters[office_id] -= take
+            self.next_steps[truck_id] = self.pickup_steps(truck_id, office_id)
+            column = offices[office_id:office_id + 1]
+            rest = np.arange(row + 1, len(idle))
+            if candidates is not None:
+                rest = rest[candidates[rest, office_id]]
+            scores[rest, office_id] = self.score_matrix(func, self, cap_left[rest], office_scooters[column],
+                                                        None if dist is None else dist[rest][:, column],
+                                                        column)[:, 0]
+
+    def assignment_scores(self, idle, office_scooters):
+        """
+        Score the idle trucks against the pickup slots they are candidates
+        for, see candidate_trucks. Scooters at an office are split into slots
+        of at most CAPACITY, so several trucks can share a busy office.
 
-    def greedy_algo(self, scooter_qty):
+        Args:
+            idle List(int): ids of idle trucks that are not full
+            office_scooters List(int): number of scooters at office locations
+
+        Returns:
+            rows array(int): position in idle of the truck of each scored pair
+            slots array(int): slot of each scored pair
+            scores array(float): score of each pair, -inf if the office cannot be reached
+            takes array(int): scooters the truck of each pair would take from its slot
+            slot_office array(int): office of each slot
+        """
+        slot_office, slot_size = [], []
+        for office_id, qty in enumerate(office_scooters):
+            for start in range(0, int(qty), SimulateTrucks.CAPACITY):
+                slot_office.append(office_id)
+                slot_size.append(min(SimulateTrucks.CAPACITY, qty - start))
+        slot_office = np.array(slot_office, dtype=np.int64)
+        candidates = self.candidate_trucks(idle, np.unique(slot_office))
+        dist = self.candidate_distances(idle, candidates)
+        rows, slots = np.nonzero(candidates[:, slot_office])
+        cap_left = SimulateTrucks.CAPACITY - np.array([self.truck_cap[i] for i in idle])
+        takes = np.minimum(cap_left[rows], np.array(slot_size, dtype=np.int64)[slots])
+        scores = self.score_function(takes, dist[rows, slot_office[slots]])
+        scores[~np.isfinite(scores)] = -np.inf
+        return rows, slots, scores, takes, slot_office
+
+    def candidate_distances(self, idle, candidates):
+        """
+        Returns:
+            array(float): idle trucks x offices distances, only filled in for candidate pairs, inf elsewhere
+        """
+        dist = np.full(candidates.shape, np.inf)
+        for row, truck_id in enumerate(idle):
+            columns = np.flatnonzero(candidates[row])
+            if len(columns):
+                dist[row, columns] = self.router.distances_index(self.truck_pos[truck_id],
+                                                                 [self.offices[k] for k in columns.tolist()])
+        return dist
+
+    def candidate_trucks(self, idle, office_ids):
+        """
+        The idle trucks closest to each office as the crow flies, found with a
+        KD-tree over truck positions, so planning only computes distances and
+        scores for trucks that can reasonably serve an office. All trucks are
+        candidates while there are at most CANDIDATES of them.
+
+        Args:
+            idle List(int): ids of idle trucks
+            office_ids array(int): offices with scooters to pick up
+
+        Returns:
+            array(bool): idle trucks x offices, whether a truck is a candidate for an office
+        """
+        candidates = np.zeros((len(idle), len(self.offices)), dtype=bool)
+        if len(idle) <= SimulateTrucks.CANDIDATES:
+            candidates[:, office_ids] = True
+            return candidates
+        pos = self.truck_pos[idle]
+        x, y = self.store.x, self.store.y
+        tree = KDTree(KDTree.planar(x[pos], y[pos]))
+        offices = np.asarray(self.offices)[office_ids]
+        scale = np.cos(np.radians(y[pos].mean()))
+        for office_id, node in zip(office_ids.tolist(), offices.tolist()):
+            rows, _ = tree.query((x[node] * scale, y[node]), SimulateTrucks.CANDIDATES)
+            candidates[rows, office_id] = True
+        return candidates
+
+    def assign_paths(self, scooter_qty):
+        """
+        Assign all idle trucks to pickup slots at once, maximizing the number
+        of trucks sent and then the total score, as a min cost flow problem
+        source -> truck -> slot -> sink. Unlike calculate_path the result does
+        not depend on truck order. Method is called every turn.
+
+        Args:
+            scooter_qty: number of scooters at office locations
+        """
         office_scooters = list(scooter_qty)
+        idle = []
         for truck_id in range(SimulateTrucks.NUMBER):
-            if not self.next_steps[truck_id]:
-                if self.truck_cap[truck_id] == SimulateTrucks.CAPACITY:
-                    steps = self.get_shortest_path(self.truck_pos[truck_id], self.metro)
-                    steps = [self.map.node.get(i) for i in steps[1:]]
-                    self.next_steps[truck_id] = deque(steps)
-                else:
-                    score, office_id = self.best_greedy_score(self.truck_pos[truck_id], office_scooters)
-                    take = min(SimulateTrucks.CAPACITY - self.truck_cap[truck_id], office_scooters[office_id])
-                    if not take:
-                        self.next_steps[truck_id] = None
-                    else:
-                        office_scooters[office_id] -= take
-                        path = self.get_shortest_path(self.truck_pos[truck_id], self.offices[office_id])
-                        self.next_steps[truck_id] = deque([self.map.node.get(i) for i in path[1:]])
+            if not self.is_idle(truck_id):
+                continue
+            if self.truck_cap[truck_id] == SimulateTrucks.CAPACITY:
+                self.next_steps[truck_id] = self.unload_steps(truck_id)
+            else:
+                idle.append(truck_id)
+                self.next_steps[truck_id] = None
+        if not idle or not sum(office_scooters):
+            return
+
+        import networkx as nx
+
+        rows, slots, scores, takes, slot_office = self.assignment_scores(idle, office_scooters)
+        # offices a truck cannot reach score -inf and get no edge
+        reachable = np.isfinite(scores)
+        if not reachable.any():
+            return
+        rows, slots, takes = rows[reachable], slots[reachable], takes[reachable]
+        # integer costs, shifted below zero by enough that sending one more
+        # truck always beats any difference in score
+        cost = np.rint(-scores[reachable] * 100).astype(np.int64)
+        spread = int(cost.max() - cost.min()) + 1
+        cost -= int(cost.max()) + spread * len(idle)
+        flow = nx.DiGraph()
+        flow.add_node('source', demand=-len(idle))
+        flow.add_node('sink', demand=len(idle))
+        take_of = {}
+        starts = np.searchsorted(rows, np.arange(len(idle) + 1))  # pairs are sorted by truck
+        for row in range(len(idle)):
+            flow.add_edge('source', ('truck', row), capacity=1, weight=0)
+            flow.add_edge(('truck', row), 'sink', capacity=1, weight=0)
+            pairs = slice(starts[row], starts[row + 1])
+            for slot, weight, take in zip(slots[pairs].tolist(), cost[pairs].tolist(), takes[pairs].tolist()):
+                flow.add_edge(('truck', row), ('slot', slot), capacity=1, weight=weight)
+                take_of[row, slot] = take
+        for slot in range(len(slot_office)):
+            flow.add_edge(('slot', slot), 'sink', capacity=1, weight=0)
+        _, flow_dict = nx.network_simplex(flow)
+
+        for row, truck_id in enumerate(idle):
+            for node, units in flow_dict[('truck', row)].items():
+                if not units or node == 'sink':
+                    continue
+                slot = node[1]
+                office_id = int(slot_office[slot])
+                take = min(take_of[row, slot], office_scooters[office_id])
+                office_scooters[office_id] -= take
+                self.next_steps[truck_id] = self.pickup_steps(truck_id, office_id)
+
+    def greedy_algo(self, scooter_qty):
+        self.calculate_path(scooter_qty, 'greedy')
 
     def aging_algo(self, scooter_qty):
-        office_scooters = list(scooter_qty)
-        for truck_id in range(SimulateTrucks.NUMBER):
-            if not self.next_steps[truck_id]:
-                if self.truck_cap[truck_id] == SimulateTrucks.CAPACITY:
-                    steps = self.get_shortest_path(self.truck_pos[truck_id], self.metro)
-                    steps = [self.map.node.get(i) for i in steps[1:]]
-                    self.next_steps[truck_id] = deque(steps)
-                else:
-                    score, office_id = self.best_aging_score(office_scooters)
-                    take = min(SimulateTrucks.CAPACITY - self.truck_cap[truck_id], office_scooters[office_id])
-                    if not take:
-                        self.next_steps[truck_id] = None
-                    else:
-                        office_scooters[office_id] -= take
-                        path = self.get_shortest_path(self.truck_pos[truck_id], self.offices[office_id])
-                        self.next_steps[truck_id] = deque([self.map.node.get(i) for i in path[1:]])
+        self.calculate_path(scooter_qty, 'aging')
 
     def update_truck_pos(self, metro_scooters, office_scooters):
         """
-        Checks if a truck has reached its objective. If it is a metro,
-        add scooters to metro capacity. If it is a office takes scooters,
+        Checks if a truck has reached its objective. If it is a hub,
+        add scooters to hub capacity. If it is a office takes scooters,
         according to capacity. Method is called every turn to update truck
         positions.
 
         Args:
-            metro_scooters: number of scooters at metro
+            metro_scooters: number of scooters at metro, or array of scooters at each hub
             office_scooters: number of scooters at office locations
         """
         for i, steps in enumerate(self.next_steps):
-            if not steps:
+            if self.is_idle(i):
                 continue
-            step = steps.popleft()
+            step = int(steps[0])
+            self.next_steps[i] = steps[1:]
             self.dist_travelled += 1
-            if step == self.metro:
-                # delivered scooters to metro
-                metro_scooters += self.truck_cap[i]
+            office_id = self.office_at[step]
+            hub = self.hub_at[step]
+            if hub >= 0:
+                # delivered scooters to hub
+                if np.ndim(metro_scooters):
+                    metro_scooters[hub] += self.truck_cap[i]
+                else:
+                    metro_scooters += self.truck_cap[i]
                 self.truck_cap[i] = 0
                 self.truck_pos[i] = step
                 self.next_steps[i] = None
-            elif step in self.offices:
+            elif office_id >= 0:
                 # reached office location
-                office_id = self.office_mapping[step['osmid']]
                 take = min(SimulateTrucks.CAPACITY - self.truck_cap[i], office_scooters[office_id])
                 office_scooters[office_id] -= take
                 self.truck_cap[i] += take
@@ -256,3 +488,28 @@ class SimulateTrucks:
         else:
             metrics.append(self.scooters_picked / (SimulateTrucks.NUMBER * self.dist_travelled))
         return metro_scooters, office_scooters, metrics
+
+
+@SimulateTrucks.register_score('aging', distances=False)
+def aging_scores(trucks, cap_left, scooters, dist, offices):
+    """
+    Scooters waiting at an office, weighted by how long no truck visited it
+    and how likely its scooters are to stay unused.
+    """
+    waiting = np.asarray(trucks.turns_without_visit)[offices]
+    return scooters * waiting * np.asarray(trucks.idle_prob)[offices]
+
+
+@SimulateTrucks.register_score('greedy')
+def greedy_scores(trucks, cap_left, scooters, dist, offices):
+    """
+    Score of the trip for the scooters each truck can pick up and its distance.
+    """
+    return trucks.score_function(np.minimum(cap_left[:, None], scooters[None, :]), dist)
+
+
+@SimulateTrucks.register_score('combined')
+def combined_scores(trucks, cap_left, scooters, dist, offices):
+    a = SimulateTrucks.COMBINED_RATIO
+    return (aging_scores(trucks, cap_left, scooters, dist, offices) * a +
+            greedy_scores(trucks, cap_left, scooters, dist, offices) * (1 - a))
@@ -1,46 +1,102 @@
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
+import numpy as np
 from matplotlib import animation
 from matplotlib import style
 
 
 class VisualizeData:
-    DATA_POINTS = 4
+    MAX_POINTS = 2000  # vertices drawn per line, older history is thinned out beyond this
+    GROWTH = 2  # factor by which axis limits grow when exceeded
 
-    def __init__(self, data):
+    def __init__(self, data, blit=True):
+        """
+        Args:
+            data MetricsRecorder: recorded metrics, anything with a column(name) method
+            blit bool: redraw only the lines when displaying interactively, the axes are then
+                fixed to the whole run up front, as blitting would keep stale ticks of moved limits
+        """
         self.data = data
-        self.frames = len(data) // self.DATA_POINTS
-        self.avg_waiting_time = self.data[0::self.DATA_POINTS]
-        self.customers_dropped = self.data[1::self.DATA_POINTS]
-        self.under_utilization = self.data[2::self.DATA_POINTS]
-        self.truck_utilization = self.data[3::self.DATA_POINTS]
+        self.avg_waiting_time = data.column('avg_waiting_time')
+        self.customers_dropped = data.column('customers_dropped')
+        self.under_utilization = data.column('under_utilization')
+        self.truck_utilization = data.column('truck_utilization')
+        self.frames = len(self.avg_waiting_time)
+        self.xs = np.arange(self.frames, dtype=np.float64)
+        self.series = [
+            (self.customers_dropped, "Customers dropped with time"),
+            (self.avg_waiting_time, "Average customer waiting time"),
+            (self.under_utilization, "Average idle state per scooter per turn"),
+            (self.truck_utilization, "Average truck utilzation"),
+        ]
+        self.axes = []
+        self.lines = []
+        self.blit = blit
         self.fig = plt.figure()
-        self.ani = animation.FuncAnimation(self.fig, self.animate, init_func=self.setup_plot, frames=self.frames)
+        self.ani = animation.FuncAnimation(self.fig, self.animate, init_func=self.setup_plot, frames=self.frames,
+                                           blit=blit)
 
     def animate(self, frame):
-        xs = range(frame + 1)
-        self.ax1.clear()
-        self.ax1.plot(xs, self.customers_dropped[:frame + 1])
-        self.ax2.clear()
-        self.ax2.plot(xs, self.avg_waiting_time[:frame + 1])
-        self.ax3.clear()
-        self.ax3.plot(xs, self.under_utilization[:frame + 1])
-        self.ax4.clear()
-        self.ax4.plot(xs, self.truck_utilization[:frame + 1])
-        self.ax1.set_title("Customers dropped with time")
-        self.ax2.set_title("Average customer waiting time")
-        self.ax3.set_title("Average idle state per scooter per turn")
-        self.ax4.set_title("Average truck utilzation")
+        """
+        Extend each line to the given frame. Lines are persistent artists whose
+        data is updated in place. Without blitting, axis limits only change when
+        a new point falls outside of them.
+        """
+        # bounded number of vertices, stride through history once it is long
+        step = frame // VisualizeData.MAX_POINTS + 1
+        for ax, line, (values, _) in zip(self.axes, self.lines, self.series):
+            xs, ys = self.xs[:frame + 1:step], values[:frame + 1:step]
+            if frame % step:
+                # always end the line at the newest point
+                xs, ys = np.append(xs, frame), np.append(ys, values[frame])
+            line.set_data(xs, ys)
+            if not self.blit:
+                self.grow_limits(ax, frame, values[frame])
+        return self.lines
+
+    @staticmethod
+    def grow_limits(ax, x, y):
+        """
+        Returns:
+            bool: True if the limits of the axis changed
+        """
+        changed = False
+        x_low, x_high = ax.get_xlim()
+        if x > x_high:
+            ax.set_xlim(x_low, x * VisualizeData.GROWTH)
+            changed = True
+        y_low, y_high = ax.get_ylim()
+        if y < y_low or y > y_high:
+            low, high = min(y_low, y), max(y_high, y)
+            margin = (high - low) * (VisualizeData.GROWTH - 1) / 2
+            ax.set_ylim(low - margin if y < y_low else low, high + margin if y > y_high else high)
+            changed = True
+        return changed
 
     def setup_plot(self):
+        if self.lines:
+            for line in self.lines:
+                line.set_data([], [])
+            return self.lines
         style.use('bmh')
         spec = gridspec.GridSpec(ncols=2, nrows=2, figure=self.fig)
-        self.ax1 = self.fig.add_subplot(spec[0, 0])
-        self.ax2 = self.fig.add_subplot(spec[0, 1])
-        self.ax3 = self.fig.add_subplot(spec[1, 0])
-        self.ax4 = self.fig.add_subplot(spec[1, 1])
+        self.axes = [self.fig.add_subplot(spec[row, col]) for row in range(2) for col in range(2)]
+        for ax, (values, title) in zip(self.axes, self.series):
+            self.lines.append(ax.plot([], [])[0])
+            ax.set_title(title)
+            if self.blit and len(values):
+                low, high = float(np.min(values)), float(np.max(values))
+                margin = (high - low) * 0.05 if high > low else 1.
+                ax.set_xlim(0, max(self.frames - 1, 1))
+                ax.set_ylim(low - margin, high + margin)
+            else:
+                ax.set_xlim(0, 10)
+                first = float(values[0]) if len(values) else 0.
+                ax.set_ylim(first - 1, first + 1)
         plt.subplots_adjust(top=0.92, bottom=0.08, left=0.10, right=0.95, hspace=0.25,
                             wspace=0.35)
         manager = plt.get_current_fig_manager()
-        manager.resize(*manager.window.maxsize())
+        if hasattr(manager, 'window'):
+            manager.resize(*manager.window.maxsize())
         self.fig.set_size_inches((13, 7), forward=False)
+        return self.lines